@@ -0,0 +1,293 @@
+import argparse
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pyloudnorm as pyln
+import soundfile as sf
+
+import audio_normalize as an
+import cue_audio_splitter as cas
+
+SEED = 20240601
+DEFAULT_FORMATS = ["wav", "flac", "mp3"]
+DEFAULT_RATES = [44100, 96000]
+DEFAULT_DURATIONS = [30.0]
+CORPUS_LUFS = [-23.0, -16.0, -9.0]
+CUE_TRACKS = 8
+PARSE_REPEAT = 200
+
+
+def generate_signal(kind: str, rate: int, duration: float, rng: np.random.Generator) -> np.ndarray:
+    n = int(rate * duration)
+    t = np.arange(n) / rate
+    if kind == "tone":
+        freqs = rng.uniform(110.0, 1760.0, size=3)
+        left = sum(np.sin(2 * np.pi * f * t) for f in freqs)
+        right = sum(np.sin(2 * np.pi * f * 1.01 * t) for f in freqs)
+        data = np.stack([left, right], axis=1)
+    else:
+        data = rng.standard_normal((n, 2))
+    return data / np.max(np.abs(data))
+
+
+def generate_corpus(corpus_dir: Path, formats: list[str], rates: list[int], durations: list[float]) -> list[dict]:
+    # Deterministic: the same arguments always produce the same files, so
+    # runs on different machines or commits time identical input.
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(SEED)
+    files = []
+    index = 0
+    for kind in ("tone", "noise"):
+        for rate in rates:
+            for duration in durations:
+                lufs = CORPUS_LUFS[index % len(CORPUS_LUFS)]
+                index += 1
+                data = generate_signal(kind, rate, duration, rng)
+                meter = pyln.Meter(rate)
+                data = pyln.normalize.loudness(data, meter.integrated_loudness(data), lufs)
+                data = np.clip(data, -1.0, 1.0)
+
+                stem = f"{kind}_{rate}_{int(duration)}s"
+                wav_path = corpus_dir / f"{stem}.wav"
+                sf.write(wav_path, data, rate, subtype="PCM_24")
+                for fmt in formats:
+                    path = corpus_dir / f"{stem}.{fmt}"
+                    if fmt == "flac":
+                        sf.write(path, data, rate, subtype="PCM_24")
+                    elif fmt == "mp3":
+                        subprocess.run(
+                            ["ffmpeg", "-y", "-v", "error", "-i", str(wav_path),
+                             "-c:a", "libmp3lame", "-q:a", "0", str(path)],
+                            check=True,
+                        )
+                    files.append({
+                        "path": str(path), "format": fmt, "kind": kind,
+                        "rate": rate, "duration": duration, "lufs": lufs,
+                    })
+                if "wav" not in formats:
+                    wav_path.unlink()
+    return files
+
+
+def generate_cue_image(corpus_dir: Path, rate: int, duration: float) -> dict:
+    rng = np.random.default_rng(SEED + 1)
+    image_dir = corpus_dir / "cue_image"
+    image_dir.mkdir(parents=True, exist_ok=True)
+    data = 0.5 * generate_signal("tone", rate, duration, rng)
+    image_path = image_dir / "image.flac"
+    sf.write(image_path, data, rate, subtype="PCM_16")
+
+    lines = ['PERFORMER "Benchmark"', 'TITLE "Synthetic Image"',
+             'FILE "image.flac" WAVE']
+    track_frames = int(duration * 75) // CUE_TRACKS
+    for track in range(CUE_TRACKS):
+        frames = track * track_frames
+        mm, rest = divmod(frames, 60 * 75)
+        ss, ff = divmod(rest, 75)
+        lines += [f"  TRACK {track + 1:02d} AUDIO",
+                  f'    TITLE "Track {track + 1}"',
+                  f"    INDEX 01 {mm:02d}:{ss:02d}:{ff:02d}"]
+    cue_path = image_dir / "image.cue"
+    cue_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return {"path": str(image_path), "cue": str(cue_path), "format": "flac",
+            "rate": rate, "duration": duration}
+
+
+def prepare_stage(stage: str, entry: dict, scratch: str) -> dict:
+    # Builds a stage's inputs in its own worker process and leaves them in
+    # scratch files, so the decodes and arrays made only for setup never
+    # count towards the timed stage's peak RSS or ffmpeg RSS.
+    src = Path(entry["path"])
+    work = Path(scratch)
+    wav_path = work / "decoded.wav"
+    prepared = {}
+    if stage in ("measure_loudness", "normalize_loudness", "encode_from_data"):
+        an.decode_to_wav(src, wav_path)
+    if stage in ("normalize_loudness", "encode_from_data"):
+        prepared["lufs"] = an.measure_loudness(wav_path)
+    if stage == "encode_from_data":
+        np.save(work / "normalized.npy",
+                an.normalize_loudness(wav_path, prepared["lufs"], -16.0))
+        prepared["rate"] = sf.info(wav_path).samplerate
+    if stage == "encode_stream":
+        prepared["measured"] = an.measure_stream(src)
+        prepared["rate"], prepared["channels"], _ = an.probe_audio(src)
+    if stage == "split_audio_by_cue":
+        shutil.copytree(src.parent, work / "image")
+    return prepared
+
+
+def run_stage(stage: str, entry: dict, scratch: str, prepared: dict) -> dict:
+    # Runs in a fresh worker process, so ru_maxrss is this stage's peak.
+    src = Path(entry["path"])
+    work = Path(scratch)
+    wav_path = work / "decoded.wav"
+    audio_seconds = entry["duration"]
+
+    # Only reading prepared inputs happens here, untimed.
+    if stage == "encode_from_data":
+        normalized = np.load(work / "normalized.npy")
+    if stage == "split_audio_by_cue":
+        image_dir = work / "image"
+        image = image_dir / src.name
+        tracks = cas.parse_cue(str(image_dir / Path(entry["cue"]).name)).tracks
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    if stage == "decode_to_wav":
+        an.decode_to_wav(src, wav_path)
+    elif stage == "decode_to_array":
+        an.decode_to_array(src)
+    elif stage == "measure_loudness":
+        an.measure_loudness(wav_path)
+    elif stage == "measure_stream":
+        an.measure_stream(src)
+    elif stage == "normalize_loudness":
+        an.normalize_loudness(wav_path, prepared["lufs"], -16.0)
+    elif stage == "encode_from_data":
+        an.encode_from_data(normalized, prepared["rate"], work / "encode.wav",
+                            work / f"out{src.suffix}", src)
+    elif stage == "encode_stream":
+        an.encode_stream(src, work / f"out{src.suffix}",
+                         an.gain_for(prepared["measured"], -16.0),
+                         prepared["rate"], prepared["channels"])
+    elif stage == "parse_cue":
+        for _ in range(PARSE_REPEAT):
+            cas.parse_cue(entry["cue"], cached=False)
+        audio_seconds *= PARSE_REPEAT
+    elif stage == "split_audio_by_cue":
+        cas.split_audio_by_cue(str(image), tracks, "CD01-")
+    wall = time.perf_counter() - start
+
+    return {
+        "stage": stage,
+        "file": src.name,
+        "format": entry["format"],
+        "rate": entry["rate"],
+        "audio_seconds": audio_seconds,
+        "wall_seconds": wall,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "throughput": audio_seconds / wall if wall > 0 else float("inf"),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "child_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+AUDIO_STAGES = [
+    "decode_to_wav", "decode_to_array", "measure_loudness", "measure_stream",
+    "normalize_loudness", "encode_from_data", "encode_stream",
+]
+CUE_STAGES = ["parse_cue", "split_audio_by_cue"]
+
+
+def summarize(results: list[dict]) -> dict:
+    summary = {}
+    for result in results:
+        s = summary.setdefault(result["stage"], {
+            "audio_seconds": 0.0, "wall_seconds": 0.0,
+            "peak_rss_kb": 0, "child_peak_rss_kb": 0,
+        })
+        s["audio_seconds"] += result["audio_seconds"]
+        s["wall_seconds"] += result["wall_seconds"]
+        s["peak_rss_kb"] = max(s["peak_rss_kb"], result["peak_rss_kb"])
+        s["child_peak_rss_kb"] = max(s["child_peak_rss_kb"], result["child_peak_rss_kb"])
+    for s in summary.values():
+        s["throughput"] = s["audio_seconds"] / s["wall_seconds"] if s["wall_seconds"] else 0.0
+    return summary
+
+
+def print_summary(summary: dict, baseline: dict | None) -> None:
+    header = f"{'Stage':<22} {'Audio s/s':>12} {'Wall (s)':>10} {'Peak RSS':>10} {'ffmpeg RSS':>11}"
+    if baseline:
+        header += f" {'vs base':>9}"
+    print(header)
+    print("-" * len(header))
+    for stage, s in summary.items():
+        line = (f"{stage:<22} {s['throughput']:>12.1f} {s['wall_seconds']:>10.2f} "
+                f"{s['peak_rss_kb'] / 1024:>8.0f}MB {s['child_peak_rss_kb'] / 1024:>9.0f}MB")
+        if baseline:
+            base = baseline.get(stage)
+            if base and base["throughput"]:
+                change = (s["throughput"] / base["throughput"] - 1.0) * 100
+                line += f" {change:>+8.1f}%"
+            else:
+                line += f" {'n/a':>9}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark audio_normalize.py and cue_audio_splitter.py "
+                    "stages on a synthetic corpus."
+    )
+    parser.add_argument("--corpus", type=Path,
+                        help="Directory for the generated corpus (default: a temp dir).")
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_FORMATS,
+                        choices=DEFAULT_FORMATS)
+    parser.add_argument("--rates", nargs="+", type=int, default=DEFAULT_RATES)
+    parser.add_argument("--durations", nargs="+", type=float, default=DEFAULT_DURATIONS,
+                        help="Durations in seconds (default: 30).")
+    parser.add_argument("--stages", nargs="+", default=AUDIO_STAGES + CUE_STAGES,
+                        choices=AUDIO_STAGES + CUE_STAGES)
+    parser.add_argument("-o", "--output", type=Path, default=Path("benchmark.json"),
+                        help="JSON file to write results to (default: benchmark.json).")
+    parser.add_argument("--compare", type=Path,
+                        help="Earlier results JSON to compare throughput against.")
+    args = parser.parse_args()
+
+    an.check_ffmpeg("ffprobe")
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["summary"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = args.corpus or Path(tmp) / "corpus"
+        print(f"Generating corpus in '{corpus_dir}' ...")
+        corpus = generate_corpus(corpus_dir, args.formats, args.rates, args.durations)
+        image = generate_cue_image(corpus_dir, 44100, max(args.durations) * 4)
+
+        results = []
+        for stage in args.stages:
+            entries = [image] if stage in CUE_STAGES else corpus
+            for entry in entries:
+                with tempfile.TemporaryDirectory(dir=tmp) as scratch:
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        prepared = pool.submit(prepare_stage, stage, entry, scratch).result()
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        result = pool.submit(run_stage, stage, entry, scratch,
+                                             prepared).result()
+                print(f"  {stage:<22} {result['file']:<28} "
+                      f"{result['throughput']:>10.1f} audio-s/s")
+                results.append(result)
+
+    summary = summarize(results)
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "corpus": {"formats": args.formats, "rates": args.rates,
+                   "durations": args.durations, "seed": SEED},
+        "results": results,
+        "summary": summary,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print_summary(summary, baseline)
+    print(f"\nResults written to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,335 @@
 import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
 import subprocess
 import sys
 import tempfile
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager, redirect_stdout
+from functools import partial
 from pathlib import Path
+from typing import NamedTuple
 
 import numpy as np
 import pyloudnorm as pyln
+import scipy.signal
 import soundfile as sf
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 SUPPORTED_EXTENSIONS = {".mp3", ".wav", ".flac", ".ape"}
 TARGET_LUFS_MIN = -30.0
 TARGET_LUFS_MAX = -14.0
 ANTI_CLIP_CEILING = 0.95
+# Decoding, loudness filtering and gain each hold a float64 copy of the
+# signal, so a file in flight costs roughly this many bytes per sample.
+BYTES_PER_SAMPLE_IN_FLIGHT = 3 * 8
+DEFAULT_MEMORY_BUDGET_MB = 2048
+STREAM_BLOCK_FRAMES = 65536
+CACHE_FILENAME = ".loudness_cache.json"
+CACHE_VERSION = 1
+DEFAULT_TRACE_FILENAME = "audio_normalize_trace.json"
+JOURNAL_FILENAME = ".audio_normalize.journal"
+STAGING_DIRNAME = ".audio_normalize.staging"
+THROUGHPUT_FILENAME = ".audio_normalize.throughput.json"
+
+# Trace events of the current process; None unless --profile is given.
+_trace_events: list[dict] | None = None
+_trace_file = ""
+
+
+class Measurement(NamedTuple):
+    lufs: float
+    rate: int
+    peak: float
+
+
+def k_weighting_filters(rate: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    # BS.1770 K-weighting as two RBJ cookbook biquads (high shelf, then high
+    # pass), designed with the same parameters pyloudnorm's Meter uses.
+    filters = []
+    for kind, gain_db, q, fc in (("high_shelf", 4.0, 1 / np.sqrt(2), 1500.0),
+                                 ("high_pass", 0.0, 0.5, 38.0)):
+        A = 10 ** (gain_db / 40.0)
+        w0 = 2.0 * np.pi * fc / rate
+        cos_w0 = np.cos(w0)
+        alpha = np.sin(w0) / (2.0 * q)
+        if kind == "high_shelf":
+            b = [A * ((A + 1) + (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha),
+                 -2 * A * ((A - 1) + (A + 1) * cos_w0),
+                 A * ((A + 1) + (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha)]
+            a = [(A + 1) - (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha,
+                 2 * ((A - 1) - (A + 1) * cos_w0),
+                 (A + 1) - (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha]
+        else:
+            b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+            a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+        filters.append((np.array(b) / a[0], np.array(a) / a[0]))
+    return filters
+
+
+class StreamingLoudnessMeter:
+    # ITU-R BS.1770-4 integrated loudness fed one block at a time. K-weighting
+    # filter state is carried across blocks and gated-block energies go into a
+    # fixed loudness histogram, so memory does not grow with file length.
+    # Block boundaries follow pyloudnorm so both give the same result.
+    BLOCK_SIZE = 0.400
+    STEP = 0.25
+    ABSOLUTE_GATE = -70.0
+    HIST_MAX = 30.0
+    HIST_RESOLUTION = 0.01
+    CHANNEL_GAINS = (1.0, 1.0, 1.0, 1.41, 1.41)
+
+    def __init__(self, rate: int, channels: int):
+        if channels > len(self.CHANNEL_GAINS):
+            raise ValueError(f"Unsupported channel count: {channels}")
+        self.rate = rate
+        self.channels = channels
+        self.samples = 0
+        self.peak = 0.0
+
+        # Same filter design as pyloudnorm, so the two meters agree.
+        self._stages = [[b, a, np.zeros((len(a) - 1, channels))]
+                        for b, a in k_weighting_filters(rate)]
+        self._gains = np.array(self.CHANNEL_GAINS[:channels])
+
+        self._hop = 0
+        self._hop_end = self._boundary(1)
+        self._hop_energy = 0.0
+        self._hops: deque[float] = deque(maxlen=4)
+        self._blocks = 0
+
+        bins = int(round((self.HIST_MAX - self.ABSOLUTE_GATE) / self.HIST_RESOLUTION))
+        self._hist_count = np.zeros(bins, dtype=np.int64)
+        self._hist_energy = np.zeros(bins)
+
+    def _boundary(self, hop: int) -> int:
+        return int(self.BLOCK_SIZE * (hop * self.STEP) * self.rate)
+
+    def _add_block(self, energy: float) -> None:
+        self._blocks += 1
+        mean_square = energy / (self.BLOCK_SIZE * self.rate)
+        if mean_square <= 0.0:
+            return
+        loudness = -0.691 + 10.0 * np.log10(mean_square)
+        if loudness < self.ABSOLUTE_GATE:
+            return
+        index = min(int((loudness - self.ABSOLUTE_GATE) / self.HIST_RESOLUTION),
+                    len(self._hist_count) - 1)
+        self._hist_count[index] += 1
+        self._hist_energy[index] += mean_square
+
+    def _close_hop(self) -> None:
+        self._hops.append(self._hop_energy)
+        self._hop_energy = 0.0
+        self._hop += 1
+        self._hop_end = self._boundary(self._hop + 1)
+        if len(self._hops) == 4:
+            self._add_block(sum(self._hops))
+
+    def feed(self, block: np.ndarray) -> None:
+        if block.ndim == 1:
+            block = block.reshape(-1, 1)
+        if not len(block):
+            return
+        self.peak = max(self.peak, float(np.max(np.abs(block))))
+
+        filtered = block.astype(np.float64)
+        for stage in self._stages:
+            b, a, zi = stage
+            filtered, stage[2] = scipy.signal.lfilter(b, a, filtered, axis=0, zi=zi)
+        energy = np.square(filtered) @ self._gains
+
+        offset = self.samples
+        self.samples += len(energy)
+        pos = 0
+        while self._hop_end <= self.samples:
+            cut = self._hop_end - offset
+            self._hop_energy += float(np.sum(energy[pos:cut]))
+            pos = cut
+            self._close_hop()
+        self._hop_energy += float(np.sum(energy[pos:]))
 
+    def integrated_loudness(self) -> float:
+        duration = self.samples / self.rate
+        if duration < self.BLOCK_SIZE:
+            raise ValueError("Audio must have length greater than the block size.")
 
-def check_ffmpeg():
+        # pyloudnorm rounds the block count, so the stream may end inside
+        # one more (partial) block; count it the same way.
+        expected = int(np.round((duration - self.BLOCK_SIZE)
+                                / (self.BLOCK_SIZE * self.STEP))) + 1
+        count = self._hist_count.copy()
+        energy = self._hist_energy.copy()
+        tail = list(self._hops)[1:] + [self._hop_energy]
+        for _ in range(self._blocks, expected):
+            mean_square = sum(tail) / (self.BLOCK_SIZE * self.rate)
+            tail = tail[1:] + [0.0]
+            if mean_square <= 0.0:
+                continue
+            loudness = -0.691 + 10.0 * np.log10(mean_square)
+            if loudness >= self.ABSOLUTE_GATE:
+                index = min(int((loudness - self.ABSOLUTE_GATE) / self.HIST_RESOLUTION),
+                            len(count) - 1)
+                count[index] += 1
+                energy[index] += mean_square
+
+        if not count.sum():
+            return float("-inf")
+
+        relative_gate = -0.691 + 10.0 * np.log10(energy.sum() / count.sum()) - 10.0
+        centers = self.ABSOLUTE_GATE + self.HIST_RESOLUTION * (np.arange(len(count)) + 0.5)
+        gated = centers > relative_gate
+        if not count[gated].sum():
+            return float("-inf")
+        return float(-0.691 + 10.0 * np.log10(energy[gated].sum() / count[gated].sum()))
+
+
+def _children_cpu() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageClock:
+    # Accumulates the intervals one stage spends on a file (a single call, or
+    # every block of a streaming loop) into one trace event.
+    def __init__(self, name: str, spawns: bool = False):
+        self.name = name
+        self.started = time.time()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes = 0
+        # Only stages that run ffmpeg/ffprobe claim child-process CPU time.
+        self._children = _children_cpu() if spawns else None
+
+    @contextmanager
+    def measure(self, nbytes: int = 0):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.wall += time.perf_counter() - wall
+            self.cpu += time.process_time() - cpu
+            self.bytes += nbytes
+
+    def record(self, wall: float | None = None) -> None:
+        if _trace_events is None:
+            return
+        wall = self.wall if wall is None else wall
+        _trace_events.append({
+            "name": self.name,
+            "cat": "audio_normalize",
+            "ph": "X",
+            "ts": int(self.started * 1e6),
+            "dur": int(wall * 1e6),
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": {
+                "file": _trace_file,
+                "cpu_s": self.cpu,
+                "subprocess_cpu_s": (
+                    0.0 if self._children is None else _children_cpu() - self._children),
+                "bytes": self.bytes,
+            },
+        })
+
+
+@contextmanager
+def profile_stage(name: str, spawns: bool = False):
+    # Time one stage; the caller may add to clock.bytes once the size is known.
+    clock = StageClock(name, spawns)
     try:
-        subprocess.run(
-            ["ffmpeg", "-version"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            check=True,
-        )
-    except FileNotFoundError:
-        print("Error: ffmpeg is not installed or not in PATH.")
-        print("Install it from https://ffmpeg.org/download.html")
+        with clock.measure():
+            yield clock
+    finally:
+        clock.record()
+
+
+@contextmanager
+def profile_file(filepath: Path):
+    global _trace_file
+    previous, _trace_file = _trace_file, filepath.name
+    try:
+        yield
+    finally:
+        _trace_file = previous
+
+
+def call_traced(worker: Callable, task_args: tuple) -> tuple:
+    # Run one task with --profile, in the main process or a pool worker, and
+    # return its trace events with the result. Tasks start with the file path.
+    global _trace_events
+    previous, _trace_events = _trace_events, []
+    try:
+        with profile_file(task_args[0]):
+            return worker(*task_args), _trace_events
+    finally:
+        _trace_events = previous
+
+
+def write_trace(trace_path: Path) -> None:
+    try:
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": _trace_events, "displayTimeUnit": "ms"}, f)
+    except OSError as e:
+        print(f"Warning: Failed to write trace '{trace_path}': {e}")
+
+
+def print_profile(trace_path: Path) -> None:
+    stages: dict[str, list[float]] = {}
+    for event in _trace_events:
+        row = stages.setdefault(event["name"], [0, 0.0, 0.0, 0.0, 0])
+        row[0] += 1
+        row[1] += event["dur"] / 1e6
+        row[2] += event["args"]["cpu_s"]
+        row[3] += event["args"]["subprocess_cpu_s"]
+        row[4] += event["args"]["bytes"]
+
+    print(f"\n{'Stage':<26} {'Calls':>6} {'Wall (s)':>10} {'CPU (s)':>9} "
+          f"{'Subproc CPU':>12} {'MB':>9} {'MB/s':>8}")
+    print("-" * 86)
+    for name, (calls, wall, cpu, sub_cpu, nbytes) in sorted(
+            stages.items(), key=lambda item: -item[1][1]):
+        mb = nbytes / (1024 * 1024)
+        rate = mb / wall if wall > 0 else 0.0
+        print(f"{name:<26} {calls:>6} {wall:>10.2f} {cpu:>9.2f} "
+              f"{sub_cpu:>12.2f} {mb:>9.1f} {rate:>8.1f}")
+    print(f"\nTrace with {len(_trace_events)} events written to '{trace_path}'.")
+
+
+def check_ffmpeg(*extra_tools: str):
+    # ffprobe is only required by the engines that probe every file.
+    for tool in ("ffmpeg", *extra_tools):
+        try:
+            subprocess.run(
+                [tool, "-version"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+        except FileNotFoundError:
+            print(f"Error: {tool} is not installed or not in PATH.")
+            print("Install it from https://ffmpeg.org/download.html")
+            sys.exit(1)
+
+
+def check_mutagen():
+    try:
+        import mutagen  # noqa: F401
+    except ImportError:
+        print("Error: --mode tags requires the 'mutagen' package.")
+        print("Install it with: pip install mutagen")
         sys.exit(1)
 
 
@@ -46,18 +351,177 @@ def scan_directory(directory: Path) -> list[Path]:
     return files
 
 
+def iter_audio_files(directory: Path) -> Iterator[Path]:
+    # Depth-first walk that yields each directory's files (sorted) before
+    # descending, so an album's files arrive together and nothing is listed
+    # ahead of time. Hidden directories are skipped.
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        print(f"Warning: Cannot read '{directory}': {e}")
+        return
+
+    subdirs = []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if not entry.name.startswith("."):
+                subdirs.append(entry.path)
+        elif entry.is_file() and Path(entry.name).suffix.lower() in SUPPORTED_EXTENSIONS:
+            yield Path(entry.path)
+
+    for subdir in subdirs:
+        yield from iter_audio_files(Path(subdir))
+
+
+def compute_target(lufs_values: list[float]) -> tuple[float, float, int]:
+    values = np.array(lufs_values)
+    q_lo, q_hi = np.percentile(values, [10, 90])
+    trimmed = values[(values >= q_lo) & (values <= q_hi)]
+    avg_lufs = float(np.mean(trimmed)) if len(trimmed) > 0 else float(np.mean(values))
+    target_lufs = float(np.clip(avg_lufs, TARGET_LUFS_MIN, TARGET_LUFS_MAX))
+    return avg_lufs, target_lufs, len(trimmed)
+
+
+def probe_audio(input_path: Path) -> tuple[int, int, float] | None:
+    try:
+        with profile_stage("ffprobe", spawns=True):
+            result = subprocess.run(
+                [
+                    "ffprobe", "-v", "error",
+                    "-select_streams", "a:0",
+                    "-show_entries", "stream=sample_rate,channels:format=duration",
+                    "-of", "json",
+                    str(input_path),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+        info = json.loads(result.stdout)
+        stream = info["streams"][0]
+        duration = float(info.get("format", {}).get("duration", 0.0))
+        return int(stream["sample_rate"]), int(stream["channels"]), duration
+    except subprocess.CalledProcessError as e:
+        print(
+            f"  Warning: ffprobe failed on '{input_path.name}': {e.stderr.decode().strip()}")
+        return None
+    except (KeyError, IndexError, ValueError):
+        print(f"  Warning: No audio stream found in '{input_path.name}'")
+        return None
+    except FileNotFoundError:
+        # No ffprobe: memory and duration estimates fall back quietly.
+        return None
+
+
+def decode_to_array(input_path: Path) -> tuple[np.ndarray, int] | None:
+    # Decode straight into memory over a pipe instead of through a temp WAV.
+    info = probe_audio(input_path)
+    if info is None:
+        return None
+    rate, channels, _ = info
+
+    try:
+        with profile_stage("ffmpeg decode", spawns=True) as clock:
+            result = subprocess.run(
+                [
+                    "ffmpeg", "-v", "error", "-i", str(input_path),
+                    "-map", "0:a:0",
+                    "-f", "f32le", "-acodec", "pcm_f32le",
+                    "-ar", str(rate), "-ac", str(channels),
+                    "pipe:1",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+            clock.bytes = len(result.stdout)
+    except subprocess.CalledProcessError as e:
+        print(
+            f"  Warning: ffmpeg failed to decode '{input_path.name}': {e.stderr.decode().strip()}")
+        return None
+
+    with profile_stage("pcm convert") as clock:
+        data = np.frombuffer(result.stdout, dtype="<f4").reshape(-1, channels)
+        data = data.astype(np.float64)
+        clock.bytes = data.nbytes
+    return data, rate
+
+
+def decode_stream(input_path: Path, rate: int, channels: int) -> Iterator[np.ndarray]:
+    # Yield decoded float PCM in fixed-size blocks as ffmpeg produces it.
+    proc = subprocess.Popen(
+        [
+            "ffmpeg", "-v", "error", "-i", str(input_path),
+            "-map", "0:a:0",
+            "-f", "f32le", "-acodec", "pcm_f32le",
+            "-ar", str(rate), "-ac", str(channels),
+            "pipe:1",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    frame_bytes = 4 * channels
+    try:
+        while True:
+            buf = proc.stdout.read(STREAM_BLOCK_FRAMES * frame_bytes)
+            if not buf:
+                break
+            buf = buf[:len(buf) - len(buf) % frame_bytes]
+            yield np.frombuffer(buf, dtype="<f4").reshape(-1, channels)
+    except GeneratorExit:
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=stderr)
+
+
+def measure_stream(input_path: Path) -> Measurement | None:
+    info = probe_audio(input_path)
+    if info is None:
+        return None
+    rate, channels, _ = info
+
+    try:
+        meter = StreamingLoudnessMeter(rate, channels)
+        decode = StageClock("ffmpeg decode (stream)", spawns=True)
+        loudness = StageClock("loudness filter (stream)")
+        start = time.perf_counter()
+        for block in decode_stream(input_path, rate, channels):
+            with loudness.measure(block.nbytes):
+                meter.feed(block)
+        decode.bytes = loudness.bytes
+        decode.record(wall=time.perf_counter() - start - loudness.wall)
+        loudness.record()
+        return Measurement(meter.integrated_loudness(), rate, meter.peak)
+    except subprocess.CalledProcessError as e:
+        print(
+            f"  Warning: ffmpeg failed to decode '{input_path.name}': {e.stderr.decode().strip()}")
+        return None
+    except Exception as e:
+        print(f"  Warning: Failed to measure loudness: {e}")
+        return None
+
+
 def decode_to_wav(input_path: Path, wav_path: Path) -> bool:
     try:
-        subprocess.run(
-            [
-                "ffmpeg", "-y", "-i", str(input_path),
-                "-acodec", "pcm_f32le",
-                str(wav_path),
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            check=True,
-        )
+        with profile_stage("ffmpeg decode", spawns=True) as clock:
+            subprocess.run(
+                [
+                    "ffmpeg", "-y", "-i", str(input_path),
+                    "-acodec", "pcm_f32le",
+                    str(wav_path),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+            clock.bytes = wav_path.stat().st_size
         return True
     except subprocess.CalledProcessError as e:
         print(
@@ -67,9 +531,21 @@ def decode_to_wav(input_path: Path, wav_path: Path) -> bool:
 
 def measure_loudness(wav_path: Path) -> float | None:
     try:
-        data, rate = sf.read(wav_path)
-        meter = pyln.Meter(rate)
-        loudness = meter.integrated_loudness(data)
+        with profile_stage("soundfile read") as clock:
+            data, rate = sf.read(wav_path)
+            clock.bytes = data.nbytes
+    except Exception as e:
+        print(f"  Warning: Failed to measure loudness: {e}")
+        return None
+    return measure_data(data, rate)
+
+
+def measure_data(data: np.ndarray, rate: int) -> float | None:
+    try:
+        with profile_stage("loudness filter") as clock:
+            meter = pyln.Meter(rate)
+            loudness = meter.integrated_loudness(data)
+            clock.bytes = data.nbytes
         return loudness
     except Exception as e:
         print(f"  Warning: Failed to measure loudness: {e}")
@@ -78,14 +554,25 @@ def measure_loudness(wav_path: Path) -> float | None:
 
 def normalize_loudness(wav_path: Path, input_lufs: float, target_lufs: float) -> np.ndarray | None:
     try:
-        data, rate = sf.read(wav_path)
-        meter = pyln.Meter(rate)
-        data_normalized = pyln.normalize.loudness(
-            data, input_lufs, target_lufs)
+        with profile_stage("soundfile read") as clock:
+            data, rate = sf.read(wav_path)
+            clock.bytes = data.nbytes
+    except Exception as e:
+        print(f"  Warning: Failed to normalize: {e}")
+        return None
+    return normalize_data(data, input_lufs, target_lufs)
+
+
+def normalize_data(data: np.ndarray, input_lufs: float, target_lufs: float) -> np.ndarray | None:
+    try:
+        with profile_stage("gain") as clock:
+            data_normalized = pyln.normalize.loudness(
+                data, input_lufs, target_lufs)
 
-        peak = np.max(np.abs(data_normalized))
-        if peak > 1.0:
-            data_normalized = data_normalized * (ANTI_CLIP_CEILING / peak)
+            peak = np.max(np.abs(data_normalized))
+            if peak > 1.0:
+                data_normalized = data_normalized * (ANTI_CLIP_CEILING / peak)
+            clock.bytes = data.nbytes
 
         return data_normalized
     except Exception as e:
@@ -93,45 +580,678 @@ def normalize_loudness(wav_path: Path, input_lufs: float, target_lufs: float) ->
         return None
 
 
-def encode_from_data(
-    data: np.ndarray, rate: int, wav_path: Path, output_path: Path, original_path: Path
+def codec_args_for(output_path: Path) -> list[str]:
+    ext = output_path.suffix.lower()
+    if ext == ".flac":
+        return ["-c:a", "flac", "-compression_level", "8"]
+    if ext == ".ape":
+        return ["-c:a", "ape", "-compression_level", "5000"]
+    if ext == ".wav":
+        return ["-c:a", "pcm_s24le"]
+    if ext == ".mp3":
+        return ["-c:a", "libmp3lame", "-q:a", "0"]
+    return []
+
+
+def encode_from_pipe(
+    data: np.ndarray, rate: int, output_path: Path, original_path: Path
 ) -> bool:
+    # Feed raw float PCM to ffmpeg's stdin; metadata and cover art still come
+    # from the original file.
+    channels = 1 if data.ndim == 1 else data.shape[1]
     try:
-        sf.write(wav_path, data, rate)
+        with profile_stage("ffmpeg encode", spawns=True) as clock:
+            pcm = np.ascontiguousarray(data, dtype="<f4").tobytes()
+            clock.bytes = len(pcm)
+            subprocess.run(
+                [
+                    "ffmpeg", "-y",
+                    "-f", "f32le", "-ar", str(rate), "-ac", str(channels),
+                    "-i", "pipe:0",
+                    "-i", str(original_path),
+                    "-map", "0:a",
+                    "-map_metadata", "1",
+                    "-map", "1:v?",
+                    "-c:v", "copy",
+                    *codec_args_for(output_path),
+                    str(output_path),
+                ],
+                input=pcm,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"  Warning: ffmpeg encode failed: {e.stderr.decode().strip()}")
+        return False
 
-        codec_args = []
-        ext = output_path.suffix.lower()
-        if ext == ".flac":
-            codec_args = ["-c:a", "flac", "-compression_level", "8"]
-        elif ext == ".ape":
-            codec_args = ["-c:a", "ape", "-compression_level", "5000"]
-        elif ext == ".wav":
-            codec_args = ["-c:a", "pcm_s24le"]
-        elif ext == ".mp3":
-            codec_args = ["-c:a", "libmp3lame", "-q:a", "0"]
 
-        subprocess.run(
+def encode_stream(
+    input_path: Path, output_path: Path, gain: float, rate: int, channels: int
+) -> bool:
+    # Decode, apply a scalar gain and re-encode one block at a time: the
+    # decoder's stdout is copied into the encoder's stdin, so no more than one
+    # block is held in memory and nothing is written besides the output.
+    with tempfile.TemporaryFile() as encoder_log:
+        encoder = subprocess.Popen(
             [
-                "ffmpeg", "-y",
-                "-i", str(original_path),
-                "-i", str(wav_path),
-                "-map", "1:a",
-                "-map_metadata", "0",
-                "-map", "0:v?",
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "f32le", "-ar", str(rate), "-ac", str(channels),
+                "-i", "pipe:0",
+                "-i", str(input_path),
+                "-map", "0:a",
+                "-map_metadata", "1",
+                "-map", "1:v?",
                 "-c:v", "copy",
-                *codec_args,
+                *codec_args_for(output_path),
                 str(output_path),
             ],
+            stdin=subprocess.PIPE,
             stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            check=True,
+            stderr=encoder_log,
         )
+        transcode = StageClock("ffmpeg transcode (stream)", spawns=True)
+        scale = StageClock("gain (stream)")
+        start = time.perf_counter()
+        try:
+            for block in decode_stream(input_path, rate, channels):
+                with scale.measure(block.nbytes):
+                    pcm = (block * gain).astype("<f4").tobytes()
+                encoder.stdin.write(pcm)
+        except BrokenPipeError:
+            pass
+        except subprocess.CalledProcessError as e:
+            encoder.kill()
+            encoder.wait()
+            print(
+                f"  Warning: ffmpeg failed to decode '{input_path.name}': {e.stderr.decode().strip()}")
+            return False
+        finally:
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                pass
+        encoder.wait()
+        transcode.bytes = scale.bytes
+        transcode.record(wall=time.perf_counter() - start - scale.wall)
+        scale.record()
+
+        if encoder.returncode != 0:
+            encoder_log.seek(0)
+            print(f"  Warning: ffmpeg encode failed: {encoder_log.read().decode().strip()}")
+            return False
+    return True
+
+
+def write_gain_tags(filepath: Path, gain_db: float, peak: float, target_lufs: float) -> bool:
+    # ReplayGain 2.0 track tags relative to the computed target, written in
+    # place without touching the audio stream.
+    from mutagen.apev2 import APENoHeaderError, APEv2
+    from mutagen.flac import FLAC
+    from mutagen.id3 import ID3, TXXX, ID3NoHeaderError
+
+    values = {
+        "REPLAYGAIN_TRACK_GAIN": f"{gain_db:+.2f} dB",
+        "REPLAYGAIN_TRACK_PEAK": f"{peak:.6f}",
+        "REPLAYGAIN_REFERENCE_LOUDNESS": f"{target_lufs:.2f} LUFS",
+    }
+    ext = filepath.suffix.lower()
+    try:
+        with profile_stage("tag write"):
+            if ext == ".flac":
+                tags = FLAC(filepath)
+                for key, value in values.items():
+                    tags[key] = value
+                tags.save()
+            elif ext == ".mp3":
+                try:
+                    tags = ID3(filepath)
+                except ID3NoHeaderError:
+                    tags = ID3()
+                for key, value in values.items():
+                    tags.setall(f"TXXX:{key}", [TXXX(encoding=3, desc=key, text=[value])])
+                tags.save(filepath)
+            elif ext == ".ape":
+                try:
+                    tags = APEv2(filepath)
+                except APENoHeaderError:
+                    tags = APEv2()
+                for key, value in values.items():
+                    tags[key] = value
+                tags.save(filepath)
+            else:
+                return False
+        return True
+    except Exception as e:
+        print(f"  Warning: Failed to write tags: {e}")
+        return False
+
+
+def encode_from_data(
+    data: np.ndarray, rate: int, wav_path: Path, output_path: Path, original_path: Path
+) -> bool:
+    try:
+        with profile_stage("soundfile write") as clock:
+            sf.write(wav_path, data, rate)
+            clock.bytes = wav_path.stat().st_size
+        codec_args = codec_args_for(output_path)
+
+        with profile_stage("ffmpeg encode", spawns=True) as clock:
+            clock.bytes = wav_path.stat().st_size
+            subprocess.run(
+                [
+                    "ffmpeg", "-y",
+                    "-i", str(original_path),
+                    "-i", str(wav_path),
+                    "-map", "1:a",
+                    "-map_metadata", "0",
+                    "-map", "0:v?",
+                    "-c:v", "copy",
+                    *codec_args,
+                    str(output_path),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
         return True
     except subprocess.CalledProcessError as e:
         print(f"  Warning: ffmpeg encode failed: {e.stderr.decode().strip()}")
         return False
 
 
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Journal:
+    # Write-ahead log of an encode run, kept in the target directory until the
+    # run completes. Every record is fsync'd before the step it announces, so
+    # an interrupted run can resume with the same targets, skip files that
+    # were already measured or encoded, and undo a swap cut off between its
+    # two renames. Encoded outputs are staged next to the library so the
+    # final rename never crosses filesystems.
+    def __init__(self, directory: Path, fresh: bool = False):
+        self.directory = directory
+        self.path = directory / JOURNAL_FILENAME
+        self.staging = directory / STAGING_DIRNAME
+        self.targets: dict[str, float] = {}
+        self.measured: dict[str, Measurement] = {}
+        self.encoded: dict[str, str] = {}
+        self.swapping: set[str] = set()
+        self.swapped: set[str] = set()
+
+        if fresh:
+            self.path.unlink(missing_ok=True)
+            shutil.rmtree(self.staging, ignore_errors=True)
+        self.resumed = self.path.exists()
+        if self.resumed:
+            self._load()
+        # The log and staging directory are created on first use, so a run
+        # that finds nothing to do leaves no trace to "resume" next time.
+        self._file = None
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn final write from the crash
+                op, key = record["op"], record.get("file")
+                if op == "target":
+                    self.targets[record["scope"]] = record["lufs"]
+                elif op == "measured":
+                    self.measured[key] = Measurement(
+                        record["lufs"], record["rate"], record["peak"])
+                elif op == "encoded":
+                    self.encoded[key] = record["sha256"]
+                elif op == "swap":
+                    self.swapping.add(key)
+                elif op == "swapped":
+                    self.swapping.discard(key)
+                    self.swapped.add(key)
+
+    def log(self, op: str, **fields) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"op": op, **fields}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def key(self, filepath: Path) -> str:
+        return filepath.relative_to(self.directory).as_posix()
+
+    def staged_path(self, filepath: Path) -> Path:
+        name = hashlib.sha1(self.key(filepath).encode("utf-8")).hexdigest()[:16]
+        self.staging.mkdir(exist_ok=True)
+        return self.staging / f"{name}{filepath.suffix}"
+
+    def staged_output(self, filepath: Path) -> Path | None:
+        # A staged output is reusable only if it is byte-identical to what
+        # the journal recorded after encoding it.
+        key = self.key(filepath)
+        staged = self.staged_path(filepath)
+        if key in self.encoded and staged.exists() and file_sha256(staged) == self.encoded[key]:
+            return staged
+        return None
+
+    def recover(self) -> None:
+        for key in sorted(self.swapping):
+            filepath = self.directory / key
+            bak_path = filepath.with_suffix(filepath.suffix + ".bak")
+            if not bak_path.exists():
+                # Interrupted before the original was moved: nothing to undo.
+                self.log("rollback", file=key)
+            elif not filepath.exists():
+                bak_path.rename(filepath)
+                print(f"Rolled back interrupted swap: {key}")
+                self.log("rollback", file=key)
+            elif file_sha256(filepath) == self.encoded.get(key):
+                self.log("swapped", file=key)
+                self.swapped.add(key)
+            else:
+                print(f"Warning: '{key}' and its .bak both exist after an "
+                      f"interrupted swap; leaving them untouched.")
+        self.swapping.clear()
+
+    def swap(self, filepath: Path, staged: Path) -> None:
+        key = self.key(filepath)
+        bak_path = filepath.with_suffix(filepath.suffix + ".bak")
+        self.log("swap", file=key)
+        filepath.rename(bak_path)
+        staged.rename(filepath)
+        self.log("swapped", file=key)
+        self.swapped.add(key)
+
+    def finish(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self.path.unlink(missing_ok=True)
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def load_cache(directory: Path) -> dict:
+    cache_path = directory / CACHE_FILENAME
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable cache '{cache_path}': {e}")
+        return {}
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache.get("files", {})
+
+
+def save_cache(directory: Path, entries: dict) -> None:
+    cache_path = directory / CACHE_FILENAME
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "files": entries}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: Failed to write cache '{cache_path}': {e}")
+
+
+def cached_measurement(entries: dict, directory: Path, filepath: Path) -> Measurement | None:
+    entry = entries.get(filepath.relative_to(directory).as_posix())
+    if entry is None:
+        return None
+    st = filepath.stat()
+    if entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+        return None
+    return Measurement(entry["lufs"], entry["rate"], entry["peak"])
+
+
+def store_measurement(entries: dict, directory: Path, filepath: Path, measurement: Measurement) -> None:
+    st = filepath.stat()
+    entries[filepath.relative_to(directory).as_posix()] = {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "lufs": measurement.lufs,
+        "rate": measurement.rate,
+        "peak": measurement.peak,
+    }
+
+
+def gain_for(measurement: Measurement, target_lufs: float) -> float:
+    # Same gain normalize_data() applies: loudness match, then pull the peak
+    # back under the anti-clip ceiling if it would exceed full scale.
+    gain = 10.0 ** ((target_lufs - measurement.lufs) / 20.0)
+    if measurement.peak * gain > 1.0:
+        gain = ANTI_CLIP_CEILING / measurement.peak
+    return gain
+
+
+def after_gain(measurement: Measurement, gain: float) -> Measurement:
+    # Expected measurement of the re-encoded file, so an unchanged library is
+    # not re-measured on the next run. Exact up to encoder quantization.
+    return Measurement(
+        measurement.lufs + 20.0 * np.log10(gain),
+        measurement.rate,
+        measurement.peak * gain,
+    )
+
+
+def probe_duration(filepath: Path) -> float | None:
+    # Header only: libsndfile reads the length of WAV/FLAC (and MP3 on recent
+    # builds) without decoding; ffprobe covers the rest, e.g. APE.
+    try:
+        return sf.info(str(filepath)).duration
+    except RuntimeError:
+        pass
+    info = probe_audio(filepath)
+    return info[2] if info else None
+
+
+def load_throughput(directory: Path) -> dict:
+    try:
+        with open(directory / THROUGHPUT_FILENAME, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_throughput(directory: Path, phase: str, audio_seconds: float,
+                      wall_seconds: float, jobs: int) -> None:
+    # Only the latest run of each phase is kept, so estimates follow the
+    # current machine and library.
+    if audio_seconds <= 0 or wall_seconds <= 0:
+        return
+    records = load_throughput(directory)
+    records[phase] = {"audio_seconds": audio_seconds,
+                      "wall_seconds": wall_seconds, "jobs": jobs}
+    path = directory / THROUGHPUT_FILENAME
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Failed to write throughput record '{path}': {e}")
+
+
+def estimate_wall(records: dict, phase: str, audio_seconds: float, jobs: int) -> float | None:
+    # Assumes the recorded run scales linearly to the planned job count.
+    record = records.get(phase)
+    if record is None:
+        return None
+    speed = record["audio_seconds"] / record["wall_seconds"]
+    return audio_seconds / speed * record["jobs"] / jobs
+
+
+def format_duration(seconds: float) -> str:
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}"
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def print_plan(directory: Path, files: Iterable[Path], cache: dict, mode: str,
+               engine: str, jobs: int) -> None:
+    # Dry run: only the walk, the cache lookup and header-only duration
+    # probes, nothing is decoded or written.
+    apply_phase = "tags" if mode == "tags" else f"encode/{engine}"
+    measure_phase = f"measure/{engine}"
+    seconds = {measure_phase: 0.0, apply_phase: 0.0}
+    total_seconds = 0.0
+    bytes_to_write = 0
+    counts = {"files": 0, "cached": 0, "apply": 0, "skip": 0, "unknown": 0}
+
+    print(f"{'Measure':<9} {'Action':<8} {'File':<40} {'Duration':>9} {'Size':>10}")
+    print("-" * 80)
+    for filepath in files:
+        counts["files"] += 1
+        size = filepath.stat().st_size
+        duration = probe_duration(filepath)
+        if duration is None:
+            counts["unknown"] += 1
+            duration = 0.0
+        total_seconds += duration
+
+        if cached_measurement(cache, directory, filepath) is not None:
+            measure_action = "cached"
+            counts["cached"] += 1
+        else:
+            measure_action = "measure"
+            seconds[measure_phase] += duration
+
+        if mode == "tags" and filepath.suffix.lower() == ".wav":
+            action = "skip"
+        elif mode == "encode" and filepath.with_suffix(filepath.suffix + ".bak").exists():
+            action = "skip"
+        else:
+            action = "tag" if mode == "tags" else "encode"
+        if action == "skip":
+            counts["skip"] += 1
+        else:
+            counts["apply"] += 1
+            seconds[apply_phase] += duration
+            if mode == "encode":
+                # Re-encoded with the source codec, so about the same size;
+                # the original stays next to it as .bak.
+                bytes_to_write += size
+
+        name = filepath.relative_to(directory).as_posix()
+        print(f"{measure_action:<9} {action:<8} {name:<40} "
+              f"{format_duration(duration):>9} {format_bytes(size):>10}")
+
+    applied = "tagged" if mode == "tags" else "encoded"
+    print(f"\nFiles: {counts['files']} ({counts['files'] - counts['cached']} to measure, "
+          f"{counts['cached']} cached; {counts['apply']} to be {applied}, "
+          f"{counts['skip']} skipped)")
+    if counts["unknown"]:
+        print(f"  Warning: Could not read the duration of {counts['unknown']} file(s)")
+    print(f"Total audio duration: {format_duration(total_seconds)}")
+    print(f"Bytes to write: {format_bytes(bytes_to_write)}")
+
+    records = load_throughput(directory)
+    estimates = {phase: estimate_wall(records, phase, audio, jobs)
+                 for phase, audio in seconds.items()}
+    missing = [phase for phase, wall in estimates.items() if wall is None and seconds[phase] > 0]
+    if missing:
+        print(f"Estimated wall time: unknown, no recorded throughput for "
+              f"{', '.join(missing)} yet (run once without --plan)")
+    else:
+        total = sum(wall or 0.0 for wall in estimates.values())
+        parts = ", ".join(f"{phase} {format_duration(wall or 0.0)}"
+                          for phase, wall in estimates.items())
+        print(f"Estimated wall time: {format_duration(total)} ({parts}, {jobs} job(s))")
+
+
+def estimate_memory(filepath: Path, engine: str) -> int:
+    if engine == "stream":
+        return STREAM_BLOCK_FRAMES * BYTES_PER_SAMPLE_IN_FLIGHT
+    # Quietly: the worker reports an unreadable file under its own progress line.
+    with redirect_stdout(io.StringIO()):
+        info = probe_audio(filepath)
+    if info is None:
+        return 0
+    rate, channels, duration = info
+    return int(duration * rate * channels * BYTES_PER_SAMPLE_IN_FLIGHT)
+
+
+def call_captured(worker: Callable, *task_args) -> tuple[str, object]:
+    # Run one (status, result) task in a pool worker with its warnings captured
+    # into the status, so the parent prints them under that file's own
+    # progress line instead of interleaved with another file's.
+    with redirect_stdout(io.StringIO()) as output:
+        status, result = worker(*task_args)
+    return output.getvalue() + status, result
+
+
+def run_ordered(
+    worker: Callable,
+    tasks: Iterable[tuple],
+    jobs: int,
+    memory_budget: int,
+    cost: Callable[[tuple], int],
+    on_start: Callable[[tuple], None],
+) -> Iterator:
+    # Yield (task, result) pairs in task order. Tasks are pulled lazily, so a
+    # generator can keep producing work while earlier files are processed.
+    # With several jobs, tasks are only submitted while the estimated memory
+    # of everything in flight fits the budget (a single oversized task is
+    # still allowed to run on its own). Results finished ahead of a slow
+    # earlier file count towards the job limit until they are yielded.
+    if jobs <= 1:
+        for task_args in tasks:
+            on_start(task_args)
+            if _trace_events is None:
+                yield task_args, worker(*task_args)
+            else:
+                result, events = call_traced(worker, task_args)
+                _trace_events.extend(events)
+                yield task_args, result
+        return
+
+    pending = enumerate(tasks)
+    next_task = next(pending, None)
+    in_flight: dict = {}
+    finished: dict[int, tuple] = {}
+    next_index = 0
+    used = 0
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while next_task is not None or in_flight:
+            while next_task is not None and len(in_flight) + len(finished) < jobs:
+                index, task_args = next_task
+                task_cost = cost(task_args)
+                if in_flight and used + task_cost > memory_budget:
+                    break
+                if _trace_events is None:
+                    future = pool.submit(call_captured, worker, *task_args)
+                else:
+                    future = pool.submit(call_traced, partial(call_captured, worker), task_args)
+                in_flight[future] = (index, task_cost, task_args)
+                used += task_cost
+                next_task = next(pending, None)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, task_cost, task_args = in_flight.pop(future)
+                used -= task_cost
+                result = future.result()
+                if _trace_events is not None:
+                    result, events = result
+                    _trace_events.extend(events)
+                finished[index] = (task_args, result)
+
+            while next_index in finished:
+                task_args, result = finished.pop(next_index)
+                on_start(task_args)
+                yield task_args, result
+                next_index += 1
+
+
+def measure_file(
+    filepath: Path, engine: str, tmpdir: str, index: int, cached: Measurement | None = None,
+) -> tuple[str, Measurement | None]:
+    if cached is not None:
+        return f"{cached.lufs:.1f} LUFS (cached)", cached
+
+    if engine == "stream":
+        measured = measure_stream(filepath)
+        if measured is None:
+            return "SKIPPED (measurement failed)", None
+        if np.isinf(measured.lufs) or np.isnan(measured.lufs):
+            return "SKIPPED (measurement failed)", None
+        return f"{measured.lufs:.1f} LUFS", measured
+
+    if engine == "pipe":
+        decoded = decode_to_array(filepath)
+        if decoded is None:
+            return "SKIPPED (decode failed)", None
+        data, rate = decoded
+    else:
+        wav_path = Path(tmpdir) / f"measure_{index}.wav"
+        if not decode_to_wav(filepath, wav_path):
+            return "SKIPPED (decode failed)", None
+        try:
+            with profile_stage("soundfile read") as clock:
+                data, rate = sf.read(wav_path)
+                clock.bytes = data.nbytes
+        except Exception as e:
+            print(f"  Warning: Failed to measure loudness: {e}")
+            return "SKIPPED (measurement failed)", None
+        finally:
+            wav_path.unlink()
+
+    lufs = measure_data(data, rate)
+    with profile_stage("peak") as clock:
+        peak = float(np.max(np.abs(data))) if data.size else 0.0
+        clock.bytes = data.nbytes
+    del data
+
+    if lufs is None or np.isinf(lufs) or np.isnan(lufs):
+        return "SKIPPED (measurement failed)", None
+
+    return f"{lufs:.1f} LUFS", Measurement(lufs, rate, peak)
+
+
+def normalize_file(
+    filepath: Path, measured: Measurement, target_lufs: float,
+    engine: str, tmpdir: str, index: int, tmp_output: Path,
+) -> tuple[str, tuple[Path, str] | None]:
+    input_lufs, rate = measured.lufs, measured.rate
+
+    if engine == "stream":
+        # Peak comes from the measuring pass, so the anti-clip gain is known
+        # before the first block is decoded.
+        info = probe_audio(filepath)
+        if info is None:
+            return "SKIPPED (decode failed)", None
+        rate, channels, _ = info
+        encoded = encode_stream(
+            filepath, tmp_output, gain_for(measured, target_lufs), rate, channels)
+    elif engine == "pipe":
+        decoded = decode_to_array(filepath)
+        if decoded is None:
+            return "SKIPPED (decode failed)", None
+        data, rate = decoded
+        normalized = normalize_data(data, input_lufs, target_lufs)
+        del data
+        if normalized is None:
+            return "SKIPPED (normalization failed)", None
+        encoded = encode_from_pipe(normalized, rate, tmp_output, filepath)
+    else:
+        decode_wav = Path(tmpdir) / f"norm_input_{index}.wav"
+        encode_wav = Path(tmpdir) / f"norm_output_{index}.wav"
+
+        if not decode_to_wav(filepath, decode_wav):
+            return "SKIPPED (decode failed)", None
+
+        normalized = normalize_loudness(decode_wav, input_lufs, target_lufs)
+        if normalized is None:
+            return "SKIPPED (normalization failed)", None
+
+        encoded = encode_from_data(
+            normalized, rate, encode_wav, tmp_output, filepath)
+        decode_wav.unlink(missing_ok=True)
+        encode_wav.unlink(missing_ok=True)
+
+    if not encoded:
+        return "SKIPPED (encode failed)", None
+
+    return "", (tmp_output, file_sha256(tmp_output))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Normalize audio files to uniform loudness."
@@ -141,98 +1261,354 @@ def main():
         type=Path,
         help="Directory containing audio files to normalize.",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["wav", "pipe", "stream"],
+        default="wav",
+        help="'wav' decodes through temporary WAV files; 'pipe' streams "
+             "decoded PCM from ffmpeg straight into memory and back; "
+             "'stream' measures and re-encodes block by block in constant "
+             "memory (default: wav).",
+    )
+    parser.add_argument(
+        "-r", "--recursive",
+        action="store_true",
+        help="Walk the whole directory tree. Files are measured while the "
+             "walk is still running.",
+    )
+    parser.add_argument(
+        "--target-scope",
+        choices=["global", "directory"],
+        default="global",
+        help="Compute the target loudness across all files or separately "
+             "for each directory, e.g. per album (default: global).",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["encode", "tags"],
+        default="encode",
+        help="'encode' re-encodes each file at the target loudness and keeps "
+             "the original as .bak; 'tags' only writes ReplayGain tags "
+             "(FLAC, MP3, APE) and leaves the audio untouched "
+             "(default: encode).",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of files to measure/encode in parallel (default: 1, "
+             "0 = one per CPU).",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=DEFAULT_MEMORY_BUDGET_MB,
+        metavar="MB",
+        help="Approximate memory budget for decoded audio held by parallel "
+             f"jobs (default: {DEFAULT_MEMORY_BUDGET_MB}).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Ignore and do not update the {CACHE_FILENAME} measurement "
+             "cache in the target directory.",
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help=f"Discard the {JOURNAL_FILENAME} of an interrupted run instead "
+             "of resuming it.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Record wall/CPU time and bytes of every decode, measure, gain "
+             "and encode stage per file, write them as a Chrome trace "
+             "and print a breakdown.",
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=Path,
+        default=Path(DEFAULT_TRACE_FILENAME),
+        metavar="PATH",
+        help="Where --profile writes its Chrome trace "
+             f"(default: {DEFAULT_TRACE_FILENAME}).",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Dry run: list what would be measured, encoded or tagged with "
+             "the total duration, bytes to write and an estimated wall time "
+             "from earlier runs, without decoding or writing anything.",
+    )
     args = parser.parse_args()
 
-    check_ffmpeg()
+    global _trace_events
+    if args.profile:
+        _trace_events = []
+
+    check_ffmpeg(*(["ffprobe"] if args.engine in ("pipe", "stream") else []))
+    if args.mode == "tags":
+        check_mutagen()
     directory = args.directory.resolve()
-    files = scan_directory(directory)
-    total = len(files)
-    print(f"Found {total} audio file(s) in '{directory}'.\n")
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    memory_budget = args.max_memory * 1024 * 1024
+    if not directory.is_dir():
+        print(f"Error: '{directory}' is not a directory.")
+        sys.exit(1)
+
+    journal = None
+    if args.plan:
+        if args.mode == "encode" and (directory / JOURNAL_FILENAME).exists():
+            print(f"Note: An interrupted run would be resumed from '{JOURNAL_FILENAME}'.\n")
+    elif args.mode == "encode":
+        journal = Journal(directory, fresh=args.fresh)
+        if journal.resumed:
+            print(f"Resuming interrupted run from '{journal.path.name}'.\n")
+            # Undo half-finished swaps before scanning, so rolled-back files
+            # are found again.
+            journal.recover()
+
+    if args.recursive:
+        files = iter_audio_files(directory)
+        total = None
+        print(f"Scanning '{directory}' recursively.\n")
+    else:
+        files = scan_directory(directory)
+        total = len(files)
+        print(f"Found {total} audio file(s) in '{directory}'.\n")
+
+    def progress(i: int) -> str:
+        return f"[{i}/{total}]" if total else f"[{i}]"
+
+    cache = {} if args.no_cache else load_cache(directory)
+
+    if args.plan:
+        print_plan(directory, files, cache, args.mode, args.engine, jobs)
+        return
+
+    durations: dict[Path, float] = {}
+
+    def duration_of(filepath: Path) -> float:
+        # Header-only probe, for the throughput record used by --plan.
+        if filepath not in durations:
+            durations[filepath] = probe_duration(filepath) or 0.0
+        return durations[filepath]
+
+    def known_measurement(filepath: Path) -> Measurement | None:
+        if journal is not None and journal.key(filepath) in journal.measured:
+            return journal.measured[journal.key(filepath)]
+        return cached_measurement(cache, directory, filepath)
+
+    measurements: list[tuple[Path, Measurement]] = []
+    dir_targets: dict[Path, float] = {}
+    dir_values: list[float] = []
+    current_dir: Path | None = None
+
+    dir_summaries: list[str] = []
 
-    measurements: list[tuple[Path, float]] = []
+    def close_directory() -> None:
+        # Files of one directory arrive together, so its target is final as
+        # soon as the walk moves on.
+        if current_dir is None or not dir_values:
+            return
+        avg_lufs, dir_target, kept = compute_target(dir_values)
+        dir_targets[current_dir] = dir_target
+        name = current_dir.relative_to(directory).as_posix()
+        dir_summaries.append(
+            f"  {name}: trimmed average {avg_lufs:.1f} LUFS "
+            f"({kept}/{len(dir_values)} files), target {dir_target:.1f}")
+
+    measure_start = time.perf_counter()
+    measured_seconds = 0.0
     with tempfile.TemporaryDirectory() as tmpdir:
-        for i, filepath in enumerate(files, 1):
-            wav_path = Path(tmpdir) / f"measure_{i}.wav"
-            print(f"[{i}/{total}] Measuring: {filepath.name} ... ",
-                  end="", flush=True)
+        tasks = (
+            (filepath, args.engine, tmpdir, i, known_measurement(filepath))
+            for i, filepath in enumerate(files, 1)
+        )
 
-            if not decode_to_wav(filepath, wav_path):
-                print("SKIPPED (decode failed)")
-                continue
+        def announce_measure(task: tuple) -> None:
+            print(f"{progress(task[3])} Measuring: {task[0].name} ... ",
+                  end="", flush=True)
 
-            lufs = measure_loudness(wav_path)
-            if lufs is None or np.isinf(lufs) or np.isnan(lufs):
-                print("SKIPPED (measurement failed)")
+        outcomes = run_ordered(
+            measure_file, tasks, jobs, memory_budget,
+            cost=lambda task: 0 if task[4] is not None else estimate_memory(task[0], task[1]),
+            on_start=announce_measure,
+        )
+        for task, (status, measured) in outcomes:
+            filepath = task[0]
+            print(status)
+            if measured is None:
                 continue
+            if task[4] is None:
+                store_measurement(cache, directory, filepath, measured)
+                measured_seconds += duration_of(filepath)
+            if journal is not None and journal.key(filepath) not in journal.measured:
+                journal.log("measured", file=journal.key(filepath), lufs=measured.lufs,
+                            rate=measured.rate, peak=measured.peak)
+            if filepath.parent != current_dir:
+                close_directory()
+                current_dir = filepath.parent
+                dir_values = []
+            dir_values.append(measured.lufs)
+            measurements.append((filepath, measured))
+        close_directory()
+    record_throughput(directory, f"measure/{args.engine}", measured_seconds,
+                      time.perf_counter() - measure_start, jobs)
 
-            print(f"{lufs:.1f} LUFS")
-            measurements.append((filepath, lufs))
+    if not args.no_cache:
+        save_cache(directory, cache)
 
     if not measurements:
         print("\nError: Could not measure any files.")
+        if journal is not None:
+            journal.finish()
         sys.exit(1)
 
-    lufs_values = np.array([m[1] for m in measurements])
-    q_lo, q_hi = np.percentile(lufs_values, [10, 90])
-    trimmed = lufs_values[(lufs_values >= q_lo) & (lufs_values <= q_hi)]
-    avg_lufs = float(np.mean(trimmed)) if len(trimmed) > 0 else float(np.mean(lufs_values))
-    target_lufs = float(np.clip(avg_lufs, TARGET_LUFS_MIN, TARGET_LUFS_MAX))
+    lufs_values = np.array([m.lufs for _, m in measurements])
+    avg_lufs, target_lufs, kept = compute_target(lufs_values)
     print(f"\nLUFS range: {lufs_values.min():.1f} ~ {lufs_values.max():.1f}")
-    print(f"Trimmed average LUFS: {avg_lufs:.1f} (from {len(trimmed)}/{len(lufs_values)} files)")
-    print(f"Target LUFS:  {target_lufs:.1f}\n")
+    if args.target_scope == "directory":
+        print(f"Per-directory targets ({len(dir_targets)} directories):")
+        print("\n".join(dir_summaries) + "\n")
+    else:
+        print(f"Trimmed average LUFS: {avg_lufs:.1f} (from {kept}/{len(lufs_values)} files)")
+        if journal is not None and "" in journal.targets:
+            print(f"Target LUFS:  {journal.targets['']:.1f} (planned before interruption)\n")
+        else:
+            print(f"Target LUFS:  {target_lufs:.1f}\n")
 
-    results: list[tuple[Path, float, float]] = []
-    with tempfile.TemporaryDirectory() as tmpdir:
-        for i, (filepath, input_lufs) in enumerate(measurements, 1):
-            bak_path = filepath.with_suffix(filepath.suffix + ".bak")
+    def target_for(filepath: Path) -> float:
+        # A resumed run keeps the targets it planned before the interruption,
+        # even though swapped files would now shift the trimmed mean.
+        if args.target_scope == "directory":
+            scope = filepath.parent.relative_to(directory).as_posix()
+            computed = dir_targets[filepath.parent]
+        else:
+            scope, computed = "", target_lufs
+        if journal is None:
+            return computed
+        if scope not in journal.targets:
+            journal.log("target", scope=scope, lufs=computed)
+            journal.targets[scope] = computed
+        return journal.targets[scope]
 
-            if bak_path.exists():
-                print(
-                    f"[{i}/{total}] SKIPPED {filepath.name} (.bak already exists)")
+    results: list[tuple[Path, float, float]] = []
+    apply_start = time.perf_counter()
+    applied_seconds = 0.0
+    if args.mode == "tags":
+        for i, (filepath, measured) in enumerate(measurements, 1):
+            print(f"{progress(i)} Tagging: {filepath.name} ... ",
+                  end="", flush=True)
+            file_target = target_for(filepath)
+            gain_db = file_target - measured.lufs
+            if filepath.suffix.lower() == ".wav":
+                print("SKIPPED (tags not supported for .wav)")
                 continue
+            with profile_file(filepath):
+                tagged = write_gain_tags(filepath, gain_db, measured.peak, file_target)
+            if not tagged:
+                print("SKIPPED (tagging failed)")
+                continue
+            if not args.no_cache:
+                store_measurement(cache, directory, filepath, measured)
 
-            print(f"[{i}/{total}] Normalizing: {filepath.name} ... ",
-                  end="", flush=True)
+            print(f"done ({gain_db:+.1f} dB)")
+            results.append((filepath, measured.lufs, file_target))
+            applied_seconds += duration_of(filepath)
+        record_throughput(directory, "tags", applied_seconds,
+                          time.perf_counter() - apply_start, jobs)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            swapped = {i for i, (filepath, _) in enumerate(measurements, 1)
+                       if journal.key(filepath) in journal.swapped}
+            pending = [
+                (i, filepath, measured)
+                for i, (filepath, measured) in enumerate(measurements, 1)
+                if i not in swapped
+                and not filepath.with_suffix(filepath.suffix + ".bak").exists()
+            ]
+            staged = {i: journal.staged_output(filepath) for i, filepath, _ in pending}
+            tasks = [(filepath, measured, target_for(filepath), args.engine, tmpdir, i,
+                      journal.staged_path(filepath))
+                     for i, filepath, measured in pending if staged[i] is None]
 
-            decode_wav = Path(tmpdir) / f"norm_input_{i}.wav"
-            encode_wav = Path(tmpdir) / f"norm_output_{i}.wav"
+            def announce_normalize(task: tuple) -> None:
+                print(f"{progress(task[5])} Normalizing: {task[0].name} ... ",
+                      end="", flush=True)
 
-            if not decode_to_wav(filepath, decode_wav):
-                print("SKIPPED (decode failed)")
-                continue
+            outcomes = run_ordered(
+                normalize_file, tasks, jobs, memory_budget,
+                cost=lambda task: estimate_memory(task[0], task[3]),
+                on_start=announce_normalize,
+            )
+            queued = {i for i, _, _ in pending}
+            for i, (filepath, measured) in enumerate(measurements, 1):
+                input_lufs = measured.lufs
+                file_target = target_for(filepath)
+                if i in swapped:
+                    print(f"{progress(i)} Normalizing: {filepath.name} ... "
+                          f"done before interruption")
+                    results.append((filepath, input_lufs, file_target))
+                    continue
+                if i not in queued:
+                    print(
+                        f"{progress(i)} SKIPPED {filepath.name} (.bak already exists)")
+                    continue
 
-            normalized = normalize_loudness(
-                decode_wav, input_lufs, target_lufs)
-            if normalized is None:
-                print("SKIPPED (normalization failed)")
-                continue
+                if staged[i] is not None:
+                    print(f"{progress(i)} Normalizing: {filepath.name} ... ",
+                          end="", flush=True)
+                    tmp_output = staged[i]
+                else:
+                    _, (status, encoded) = next(outcomes)
+                    if encoded is None:
+                        print(status)
+                        continue
+                    print(status, end="")
+                    tmp_output, sha256 = encoded
+                    journal.log("encoded", file=journal.key(filepath), sha256=sha256)
+                    applied_seconds += duration_of(filepath)
 
-            tmp_output = Path(tmpdir) / f"output_{i}{filepath.suffix}"
-            _, rate = sf.read(decode_wav)
-            if not encode_from_data(normalized, rate, encode_wav, tmp_output, filepath):
-                print("SKIPPED (encode failed)")
-                continue
+                with profile_file(filepath), profile_stage("swap"):
+                    journal.swap(filepath, tmp_output)
+                if not args.no_cache:
+                    store_measurement(cache, directory, filepath,
+                                      after_gain(measured, gain_for(measured, file_target)))
 
-            filepath.rename(bak_path)
-            tmp_output.rename(filepath)
+                adjustment = file_target - input_lufs
+                print(
+                    f"done ({input_lufs:+.1f} -> {file_target:+.1f}, {adjustment:+.1f} dB)")
+                results.append((filepath, input_lufs, file_target))
 
-            adjustment = target_lufs - input_lufs
-            print(
-                f"done ({input_lufs:+.1f} -> {target_lufs:+.1f}, {adjustment:+.1f} dB)")
-            results.append((filepath, input_lufs, target_lufs))
+        journal.finish()
+        record_throughput(directory, f"encode/{args.engine}", applied_seconds,
+                          time.perf_counter() - apply_start, jobs)
+
+    if not args.no_cache:
+        save_cache(directory, cache)
 
     if results:
         print(f"\n{'File':<40} {'Original':>10} {'Target':>10} {'Adjust':>10}")
         print("-" * 72)
         for filepath, input_lufs, target in results:
             adjustment = target - input_lufs
+            name = filepath.relative_to(directory).as_posix()
             print(
-                f"{filepath.name:<40} {input_lufs:>+10.1f} {target:>+10.1f} {adjustment:>+10.1f}")
-        print(
-            f"\nDone. {len(results)} file(s) normalized. Originals saved as .bak.")
+                f"{name:<40} {input_lufs:>+10.1f} {target:>+10.1f} {adjustment:>+10.1f}")
+        if args.mode == "tags":
+            print(f"\nDone. {len(results)} file(s) tagged with ReplayGain.")
+        else:
+            print(
+                f"\nDone. {len(results)} file(s) normalized. Originals saved as .bak.")
     else:
         print("\nNo files were normalized.")
 
+    if args.profile:
+        write_trace(args.trace_file)
+        print_profile(args.trace_file)
+
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,223 @@
+import argparse
+import hashlib
+import json
 import os
 import re
-from typing import List, Tuple, Optional, Union
-from pydub import AudioSegment
+import sqlite3
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple, Optional, Union
+
+import soundfile as sf
+from mutagen.flac import FLAC
+
+# Source formats that can be split
+AUDIO_EXTENSIONS = ('.flac', '.wav')
+# Duplicate copies ending with (1), deleted before splitting
+DUPLICATE_PATTERN = re.compile(r'^(.*)\(1\)\.(flac|wav|cue)$', re.IGNORECASE)
+# Byte order marks and their encodings; UTF-32 before UTF-16, which it extends
+CUE_BOMS = (
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+)
+# "INDEX 01 00:00:00" after the keyword: index number and MM:SS:FF
+INDEX_PATTERN = re.compile(r'(\d+)\s+(\d+):(\d+):(\d+)')
+# CUE sheets count time in frames of 1/75 s (588 samples at 44.1 kHz)
+CUE_FRAMES_PER_SECOND = 75
+# Samples read and written per block while copying a track
+SPLIT_BLOCK_FRAMES = 65536
+# Library index kept in the root directory between runs
+INDEX_FILENAME = ".cue_splitter_index.sqlite"
+# Bytes hashed from each end of an image when fingerprinting it
+FINGERPRINT_CHUNK = 65536
+
+
+class LibraryIndex:
+    """Persistent SQLite index of scanned directories and split images.
+
+    Directories are stored with the mtime they had after their last complete
+    run and their list of subdirectories, so unchanged directories are not
+    listed again. Split images are stored by fingerprint, which marks them as
+    done independently of the .bak renames. The throughput of the last real
+    run is kept for --plan estimates.
+
+    A read-only index works on an in-memory copy, so nothing is written to
+    the library.
+    """
+
+    def __init__(self, root_dir: str, read_only: bool = False):
+        self.root_dir = root_dir
+        self.path = os.path.join(root_dir, INDEX_FILENAME)
+        self.read_only = read_only
+        try:
+            self._connect()
+        except sqlite3.DatabaseError as e:
+            # The index is only a cache, so a damaged one is rebuilt
+            print(f"Library index unreadable ({str(e)}), rebuilding: {self.path}")
+            self.conn.close()
+            if not self.read_only:
+                os.remove(self.path)
+            self._connect(load=False)
+
+    def _connect(self, load: bool = True) -> None:
+        if self.read_only:
+            self.conn = sqlite3.connect(":memory:")
+            if load and os.path.exists(self.path):
+                disk = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+                disk.backup(self.conn)
+                disk.close()
+        else:
+            self.conn = sqlite3.connect(self.path)
+        # No rollback journal file: creating and deleting one next to the
+        # index would change the root directory mtime on every commit
+        self.conn.execute("PRAGMA journal_mode=MEMORY")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                subdirs TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS images (
+                fingerprint TEXT PRIMARY KEY,
+                cue_path TEXT NOT NULL,
+                split_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS throughput (
+                phase TEXT PRIMARY KEY,
+                audio_seconds REAL NOT NULL,
+                wall_seconds REAL NOT NULL,
+                jobs INTEGER NOT NULL
+            );
+        """)
+
+    def _key(self, path: str) -> str:
+        # Paths are stored relative to the root, so the library can be moved
+        return os.path.relpath(path, self.root_dir)
+
+    def directory(self, dir_path: str) -> Optional[Tuple[int, List[str]]]:
+        """Look up a directory's recorded mtime and subdirectories.
+
+        Args:
+            dir_path: Directory path
+
+        Returns:
+            (mtime_ns, subdirectory paths), or None if not recorded
+        """
+        row = self.conn.execute(
+            "SELECT mtime_ns, subdirs FROM directories WHERE path = ?",
+            (self._key(dir_path),)).fetchone()
+        if row is None:
+            return None
+        return row[0], [os.path.join(self.root_dir, sub) for sub in json.loads(row[1])]
+
+    def update_directory(self, dir_path: str, mtime_ns: int, subdirs: List[str]) -> None:
+        """Record a directory as fully processed at the given mtime.
+
+        Args:
+            dir_path: Directory path
+            mtime_ns: Directory mtime after processing
+            subdirs: Paths of its subdirectories
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+            (self._key(dir_path), mtime_ns,
+             json.dumps([self._key(sub) for sub in subdirs], ensure_ascii=False)))
+
+    def forget_directory(self, dir_path: str) -> None:
+        """Drop a directory so it is listed again on the next run.
+
+        Args:
+            dir_path: Directory path
+        """
+        self.conn.execute("DELETE FROM directories WHERE path = ?", (self._key(dir_path),))
+
+    def is_split(self, fingerprint: str) -> bool:
+        """Check whether an image was already split.
+
+        Args:
+            fingerprint: Image fingerprint from image_fingerprint()
+
+        Returns:
+            True if the image is recorded as split
+        """
+        return self.conn.execute(
+            "SELECT 1 FROM images WHERE fingerprint = ?", (fingerprint,)).fetchone() is not None
+
+    def mark_split(self, fingerprint: str, cue_path: str) -> None:
+        """Record an image as split.
+
+        Args:
+            fingerprint: Image fingerprint from image_fingerprint()
+            cue_path: Path of the image's CUE sheet, kept for reference
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?)",
+            (fingerprint, self._key(cue_path), time.time()))
+        self.conn.commit()
+
+    def throughput(self, phase: str) -> Optional[Tuple[float, float, int]]:
+        """Look up the throughput recorded by the last real run of a phase.
+
+        Args:
+            phase: Phase name, "split" or "split+verify"
+
+        Returns:
+            (audio_seconds, wall_seconds, jobs), or None if never recorded
+        """
+        return self.conn.execute(
+            "SELECT audio_seconds, wall_seconds, jobs FROM throughput WHERE phase = ?",
+            (phase,)).fetchone()
+
+    def record_throughput(self, phase: str, audio_seconds: float,
+                          wall_seconds: float, jobs: int) -> None:
+        """Record the throughput of a real run, replacing the previous record.
+
+        Args:
+            phase: Phase name, "split" or "split+verify"
+            audio_seconds: Duration of the audio that was split
+            wall_seconds: Wall time the phase took
+            jobs: Number of parallel jobs used
+        """
+        if audio_seconds > 0 and wall_seconds > 0:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO throughput VALUES (?, ?, ?, ?)",
+                (phase, audio_seconds, wall_seconds, jobs))
+
+    def close(self) -> None:
+        """Commit pending changes and close the index."""
+        self.conn.commit()
+        self.conn.close()
+
+
+def image_fingerprint(audio_files: List[Tuple[str, int]], cue_path: Optional[str]) -> str:
+    """Fingerprint an image without reading all of its audio.
+
+    Hashes the CUE sheet and, for each referenced audio file, its size and
+    its first and last FINGERPRINT_CHUNK bytes, which is enough to recognise
+    the same rip again even if it was moved or renamed.
+
+    Args:
+        audio_files: (path, size) of each audio file the sheet refers to
+        cue_path: Path to the CUE file, or None for an embedded cuesheet
+
+    Returns:
+        Hex digest identifying the image
+    """
+    digest = hashlib.sha256()
+    if cue_path is not None:
+        with open(cue_path, 'rb') as f:
+            digest.update(f.read())
+    for audio_path, size in audio_files:
+        digest.update(str(size).encode())
+        with open(audio_path, 'rb') as f:
+            digest.update(f.read(FINGERPRINT_CHUNK))
+            f.seek(max(size - FINGERPRINT_CHUNK, 0))
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
 
 
 def natural_sort_key(s: str) -> List[Union[str, int]]:
@@ -21,65 +237,106 @@ def natural_sort_key(s: str) -> List[Union[str, int]]:
             for part in re.split(r'(\d+)', s)]
 
 
-def get_all_audio_files(root_dir: str) -> List[str]:
-    """Recursively collect paths of all .flac and .wav audio files in the directory.
+class DirectoryListing(NamedTuple):
+    """Files of one directory, classified during a single scandir pass.
 
-    Args:
-        root_dir: Root directory to start searching from
-
-    Returns:
-        List of absolute paths to audio files (.flac, .wav)
+    Attributes:
+        path: Directory path
+        audio_files: Paths of .flac and .wav files, naturally sorted
+        cue_files: Paths of .cue files keyed by file name without extension
+        duplicates: Paths of "(1)" duplicate .flac, .wav and .cue files
+        subdirs: Paths of subdirectories, sorted
+        entries: Cached directory entries of the audio files, keyed by path
     """
-    audio_extensions = ('.flac', '.wav')
-    audio_files = []
-
-    # Traverse all subdirectories starting from root_dir
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            # Check if file has a supported audio extension
-            if filename.lower().endswith(audio_extensions):
-                audio_path = os.path.join(dirpath, filename)
-                audio_files.append(audio_path)
+    path: str
+    audio_files: List[str]
+    cue_files: Dict[str, str]
+    duplicates: List[str]
+    subdirs: List[str]
+    entries: Dict[str, os.DirEntry]
 
-    return audio_files
 
+def walk_library(root_dir: str, index: LibraryIndex,
+                 rescan: bool = False) -> Iterator[DirectoryListing]:
+    """Walk the library once, listing directories changed since the last run.
 
-def group_audio_files_by_directory(audio_files: List[str]) -> dict:
-    """Group audio files by their parent directory.
+    Each directory is read with a single os.scandir call and its entries are
+    classified in memory, so no further metadata lookups are needed. A
+    directory whose mtime matches the index is not listed; its recorded
+    subdirectories are visited instead, since changes deeper in the tree do
+    not update the mtime of their ancestors.
 
     Args:
-        audio_files: List of audio file paths
+        root_dir: Root directory to start searching from
+        index: Library index from earlier runs
+        rescan: List every directory regardless of the index
 
-    Returns:
-        Dictionary with directory paths as keys and list of audio files in that directory as values
+    Yields:
+        DirectoryListing for each new or changed directory
     """
-    dir_groups = {}
-    for file_path in audio_files:
-        dir_path = os.path.dirname(file_path)
-        if dir_path not in dir_groups:
-            dir_groups[dir_path] = []
-        dir_groups[dir_path].append(file_path)
-    return dir_groups
+    # Subdirectory mtimes come from the parent's cached entry stats
+    stack: List[Tuple[str, Optional[int]]] = [(root_dir, None)]
+    while stack:
+        dir_path, mtime_ns = stack.pop()
+        if mtime_ns is None:
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                index.forget_directory(dir_path)  # Removed since the last run
+                continue
 
+        recorded = None if rescan else index.directory(dir_path)
+        if recorded is not None and recorded[0] == mtime_ns:
+            stack.extend((sub, None) for sub in reversed(recorded[1]))
+            continue
+
+        audio_files: List[str] = []
+        cue_files: Dict[str, str] = {}
+        duplicates: List[str] = []
+        subdirs: List[Tuple[str, int]] = []
+        entries: Dict[str, os.DirEntry] = {}
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append((entry.path, entry.stat(follow_symlinks=False).st_mtime_ns))
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if DUPLICATE_PATTERN.match(entry.name):
+                        duplicates.append(entry.path)
+                        continue
+                    stem, ext = os.path.splitext(entry.name)
+                    ext = ext.lower()
+                    if ext in AUDIO_EXTENSIONS:
+                        audio_files.append(entry.path)
+                        entries[entry.path] = entry
+                    elif ext == '.cue':
+                        cue_files[stem] = entry.path
+        except OSError as e:
+            print(f"Failed to list {dir_path}: {str(e)}")
+            continue
 
-def delete_backup_files(root_dir: str) -> None:
+        # Sort audio files using natural sorting (handles numbers correctly)
+        audio_files.sort(key=lambda x: natural_sort_key(os.path.basename(x)))
+        subdirs.sort()
+        yield DirectoryListing(dir_path, audio_files, cue_files, duplicates,
+                               [sub for sub, _ in subdirs], entries)
+        stack.extend(reversed(subdirs))
+
+
+def delete_backup_files(duplicates: List[str]) -> None:
     """Delete backup files with names ending with (1) and extensions .flac, .wav, .cue.
 
     Args:
-        root_dir: Root directory to search for backup files
+        duplicates: Paths of backup files found by walk_library()
     """
-    # Regex pattern to match files ending with (1) and specific extensions (case-insensitive)
-    pattern = re.compile(r'^(.*)\(1\)\.(flac|wav|cue)$', re.IGNORECASE)
-
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            if pattern.match(filename):
-                file_path = os.path.join(dirpath, filename)
-                try:
-                    os.remove(file_path)
-                    print(f"Deleted backup file: {file_path}")
-                except Exception as e:
-                    print(f"Failed to delete {file_path}: {str(e)}")
+    for file_path in duplicates:
+        try:
+            os.remove(file_path)
+            print(f"Deleted backup file: {file_path}")
+        except Exception as e:
+            print(f"Failed to delete {file_path}: {str(e)}")
 
 
 def clean_filename(s: str) -> str:
@@ -123,120 +380,554 @@ def clean_filename(s: str) -> str:
     return s
 
 
-def parse_cue(cue_path: str) -> List[Tuple[str, float, str, str]]:
-    """Parse CUE sheet file to extract track information.
+@dataclass(slots=True)
+class CueTrack:
+    """One TRACK entry of a CUE sheet.
+
+    Attributes:
+        number: Track number
+        title: Track TITLE, empty if missing
+        performer: Track PERFORMER, or the album PERFORMER if missing
+        file: FILE holding the track's INDEX 01
+        indexes: INDEX positions in CUE frames (1/75 s), keyed by index number
+        samples: Exact INDEX positions in samples, when the sheet has them
+            (binary FLAC cuesheets), keyed by index number
+    """
+    number: int
+    title: str = ""
+    performer: str = ""
+    file: str = ""
+    indexes: Dict[int, int] = field(default_factory=dict)
+    samples: Dict[int, int] = field(default_factory=dict)
+
+    @property
+    def start(self) -> int:
+        """Start of the track in CUE frames (INDEX 01, else INDEX 00)."""
+        return self.indexes.get(1, self.indexes.get(0, 0))
+
+    def start_sample(self, sample_rate: int) -> int:
+        """Start of the track in samples, exact when the sheet gave samples.
+
+        Args:
+            sample_rate: Sample rate of the source audio
+
+        Returns:
+            Offset of the track's first sample
+        """
+        if self.samples:
+            return self.samples.get(1, self.samples.get(0, 0))
+        return cue_frames_to_samples(self.start, sample_rate)
+
+
+@dataclass(slots=True)
+class CueSheet:
+    """Parsed CUE sheet.
+
+    Attributes:
+        title: Album TITLE
+        performer: Album PERFORMER
+        genre: REM GENRE
+        date: REM DATE
+        files: FILE references in order of appearance
+        tracks: Tracks sorted by number
+        encoding: Encoding the sheet was decoded with
+    """
+    title: str = ""
+    performer: str = ""
+    genre: str = ""
+    date: str = ""
+    files: List[str] = field(default_factory=list)
+    tracks: List[CueTrack] = field(default_factory=list)
+    encoding: str = "utf-8"
+
+
+# Parsed sheets keyed by a hash of their bytes
+_cue_cache: Dict[str, CueSheet] = {}
 
-    Extracts track number, start time (in seconds), title, and performer for each track.
-    Uses global PERFORMER from CUE if track-specific PERFORMER is missing.
+
+def detect_cue_encoding(data: bytes) -> str:
+    """Detect the text encoding of a CUE sheet from its bytes.
+
+    A byte order mark decides directly. Without one, NUL bytes concentrated
+    on odd or even offsets mark UTF-16 LE or BE, valid UTF-8 is taken as
+    UTF-8, and anything else as GBK when it decodes as GBK and most of its
+    non-ASCII characters are CJK ideographs, falling back to Latin-1. The
+    ideograph check keeps Latin-1 names like "Müller", which often happen to
+    be valid GBK byte pairs, from being decoded as Chinese.
+
+    Args:
+        data: Raw contents of the CUE file
+
+    Returns:
+        Python codec name to decode the sheet with
+    """
+    for bom, encoding in CUE_BOMS:
+        if data.startswith(bom):
+            return encoding
+
+    # ASCII text in UTF-16 has a NUL byte in every code unit
+    if data.count(0) * 4 >= len(data):
+        odd_nuls = data[1::2].count(0)
+        even_nuls = data[0::2].count(0)
+        return 'utf-16-le' if odd_nuls >= even_nuls else 'utf-16-be'
+
+    try:
+        data.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        text = data.decode('gbk')
+    except UnicodeDecodeError:
+        return 'latin-1'
+    non_ascii = [ch for ch in text if ord(ch) > 0x7F]
+    ideographs = sum(1 for ch in non_ascii if '\u4e00' <= ch <= '\u9fff')
+    return 'gbk' if ideographs * 2 >= len(non_ascii) else 'latin-1'
+
+
+def cue_value(text: str) -> str:
+    """Strip a CUE field value and the quotes around it, if any.
+
+    Args:
+        text: Rest of the line after the keyword
+
+    Returns:
+        Unquoted value
+    """
+    text = text.strip()
+    if text.startswith('"'):
+        end = text.find('"', 1)
+        return text[1:end] if end > 0 else text[1:]
+    return text
+
+
+def parse_cue(cue_path: str, cached: bool = True) -> Optional[CueSheet]:
+    """Parse CUE sheet file to extract album and track information.
+
+    The file is read once and parsed by parse_cue_data().
 
     Args:
         cue_path: Path to .cue file
+        cached: Reuse and store results in the memo
 
     Returns:
-        List of tuples containing track info:
-        [(track_number, start_seconds, title, performer), ...]
-        Empty list if parsing fails
+        Parsed CueSheet, or None if parsing fails
     """
-    # Try multiple encodings to handle different CUE file encodings
-    encodings = ['utf-8', 'gbk', 'latin-1']
-    cue_content: Optional[List[str]] = None
+    with open(cue_path, 'rb') as f:
+        data = f.read()
+    return parse_cue_data(data, cue_path, cached)
 
-    for encoding in encodings:
-        try:
-            with open(cue_path, 'r', encoding=encoding) as f:
-                cue_content = f.readlines()
-            break  # Stop if encoding works
-        except UnicodeDecodeError:
-            continue  # Try next encoding
-
-    if cue_content is None:
-        print(f"Failed to parse CUE file (encoding issue): {cue_path}")
-        return []
 
-    # Extract global performer (album-level)
-    global_performer = ""
-    global_pattern = re.compile(r'^(PERFORMER|TITLE)\s+"(.*?)"', re.IGNORECASE)
-    for line in cue_content:
-        line = line.strip()
-        match = global_pattern.match(line)
-        if match and match.group(1).upper() == 'PERFORMER':
-            global_performer = match.group(2).strip()
-            break  # Use first global performer found
-
-    # Extract track-specific information
-    tracks: List[Tuple[str, float, str, str]] = []
-    current_track_num: Optional[str] = None
-    current_title = ""
-    # Track-level performer (takes precedence over global)
-    current_performer = ""
-    current_start_sec = 0.0
-
-    # Regex patterns for parsing CUE content
-    time_pattern = re.compile(r'INDEX 01 (\d+:\d+:\d+)', re.IGNORECASE)
-    track_pattern = re.compile(r'TRACK (\d+)', re.IGNORECASE)
-    field_pattern = re.compile(r'^(TITLE|PERFORMER)\s+"(.*?)"', re.IGNORECASE)
-
-    for line in cue_content:
-        line = line.strip()
-
-        # Match track number (e.g., "TRACK 01 AUDIO")
-        track_match = track_pattern.match(line)
-        if track_match:
-            # Save previous track if it exists
-            if current_track_num is not None:
-                tracks.append((
-                    current_track_num,
-                    current_start_sec,
-                    current_title,
-                    current_performer or global_performer  # Fallback to global
-                ))
-            # Initialize new track
-            current_track_num = track_match.group(1)
-            current_title = ""
-            current_performer = ""
-            current_start_sec = 0.0
-            continue
+def parse_cue_data(data: bytes, source: str, cached: bool = True) -> Optional[CueSheet]:
+    """Parse the contents of a CUE sheet in a single pass over its lines.
 
-        # Match TITLE or PERFORMER within track definition
-        field_match = field_pattern.match(line)
-        if field_match and current_track_num is not None:
-            field_name = field_match.group(1).upper()
-            field_value = field_match.group(2).strip()
-            if field_name == 'TITLE':
-                current_title = field_value
-            elif field_name == 'PERFORMER':
-                current_performer = field_value
-            continue
+    Collects album TITLE/PERFORMER, REM GENRE/DATE, FILE references and
+    every INDEX of each track. Tracks without a PERFORMER take the album
+    PERFORMER. Results are memoized by a hash of the contents, so sheets
+    seen before are not parsed again; callers must not modify them.
 
-        # Match start time (e.g., "INDEX 01 00:00:00")
-        time_match = time_pattern.search(line)
-        if time_match and current_track_num is not None:
-            time_str = time_match.group(1)
-            # Convert MM:SS:FF (frames) to seconds (1 second = 75 frames)
-            mm, ss, ff = map(int, time_str.split(':'))
-            current_start_sec = mm * 60 + ss + ff / 75
-            continue
+    Args:
+        data: Raw contents of the sheet
+        source: Where the sheet came from, for messages
+        cached: Reuse and store results in the memo
+
+    Returns:
+        Parsed CueSheet, or None if parsing fails
+    """
+    key = hashlib.sha1(data).hexdigest()
+    if cached and key in _cue_cache:
+        return _cue_cache[key]
 
-    # Add the last track
-    if current_track_num is not None:
-        tracks.append((
-            current_track_num,
-            current_start_sec,
-            current_title,
-            current_performer or global_performer
-        ))
+    encoding = detect_cue_encoding(data)
+    sheet = CueSheet(encoding=encoding)
+    track: Optional[CueTrack] = None
+    current_file = ""
+
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError:
+        # A BOM or NUL pattern can promise an encoding the rest of the file breaks
+        print(f"Failed to parse CUE file (encoding issue): {source}")
+        return None
+
+    for line in text.splitlines():
+        # Split "KEYWORD rest" (e.g., 'TITLE "Name"', "INDEX 01 00:00:00")
+        keyword, _, rest = line.strip().partition(' ')
+        keyword = keyword.upper()
+
+        if keyword == 'TRACK':
+            # Start a new track (e.g., "TRACK 01 AUDIO")
+            try:
+                number = int(rest.split()[0])
+            except (IndexError, ValueError):
+                print(f"Invalid track number format in CUE: {source}")
+                return None
+            track = CueTrack(number, file=current_file)
+            sheet.tracks.append(track)
+        elif keyword == 'INDEX' and track is not None:
+            # Convert MM:SS:FF to frames (1 second = 75 frames)
+            match = INDEX_PATTERN.match(rest.strip())
+            if match:
+                index, mm, ss, ff = map(int, match.groups())
+                track.indexes[index] = (mm * 60 + ss) * CUE_FRAMES_PER_SECOND + ff
+                # A pregap may sit at the end of the previous FILE; the
+                # track itself belongs to the FILE of its INDEX 01
+                if index == 1:
+                    track.file = current_file
+        elif keyword == 'TITLE':
+            if track is not None:
+                track.title = cue_value(rest)
+            else:
+                sheet.title = cue_value(rest)
+        elif keyword == 'PERFORMER':
+            if track is not None:
+                track.performer = cue_value(rest)
+            elif not sheet.performer:
+                sheet.performer = cue_value(rest)  # Use first global performer found
+        elif keyword == 'FILE':
+            # FILE "name.wav" WAVE: the file type follows the name
+            value = rest.strip()
+            if value.startswith('"'):
+                current_file = cue_value(value)
+            else:
+                current_file = value.rsplit(' ', 1)[0] if ' ' in value else value
+            sheet.files.append(current_file)
+        elif keyword == 'REM':
+            field_name, _, value = rest.strip().partition(' ')
+            if field_name.upper() == 'GENRE':
+                sheet.genre = cue_value(value)
+            elif field_name.upper() == 'DATE':
+                sheet.date = cue_value(value)
+
+    # Fallback to the global performer
+    for track in sheet.tracks:
+        track.performer = track.performer or sheet.performer
 
     # Sort tracks by track number (numerical order)
+    sheet.tracks.sort(key=lambda t: t.number)
+
+    if cached:
+        _cue_cache[key] = sheet
+    return sheet
+
+
+def cue_frames_to_samples(frames: int, sample_rate: int) -> int:
+    """Convert a position in CUE frames to a sample offset.
+
+    CUE positions are counted in 1/75 s frames and are scaled with integer
+    arithmetic (588 samples per frame at 44.1 kHz), keeping track boundaries
+    sample-exact.
+
+    Args:
+        frames: Position in CUE frames
+        sample_rate: Sample rate of the source audio
+
+    Returns:
+        Offset of the sample at that position
+    """
+    return frames * sample_rate // CUE_FRAMES_PER_SECOND
+
+
+def read_embedded_cue(audio_path: str) -> Optional[CueSheet]:
+    """Read a cuesheet embedded in a FLAC file's metadata.
+
+    Only the metadata blocks at the head of the file are read; no audio is
+    decoded. A CUESHEET vorbis comment is preferred, since it carries track
+    titles and performers. Otherwise the binary CUESHEET block is used.
+    Album and artist missing from the sheet are taken from the ALBUM and
+    ARTIST vorbis comments. All tracks are assigned
+    to the FLAC file itself, whatever FILE the original sheet named.
+
+    Args:
+        audio_path: Path to a .flac file
+
+    Returns:
+        Parsed CueSheet, or None if the file has no embedded cuesheet
+    """
     try:
-        tracks.sort(key=lambda x: int(x[0]))
-    except ValueError:
-        print(f"Invalid track number format in CUE: {cue_path}")
+        flac = FLAC(audio_path)
+    except Exception:
+        return None
+    tags = flac.tags or {}
+
+    comments = tags.get('CUESHEET') or tags.get('cuesheet')
+    if comments:
+        sheet = parse_cue_data(comments[0].encode('utf-8'), audio_path, cached=False)
+    elif flac.cuesheet is not None:
+        rate = flac.info.sample_rate
+        sheet = CueSheet(title=(tags.get('ALBUM') or [""])[0],
+                         performer=(tags.get('ARTIST') or [""])[0])
+        for cue_track in flac.cuesheet.tracks:
+            if cue_track.track_number in (170, 255):
+                continue  # Lead-out
+            track = CueTrack(cue_track.track_number, performer=sheet.performer)
+            for index in cue_track.indexes:
+                # Offsets are in samples, relative to the track offset
+                offset = cue_track.start_offset + index.index_offset
+                track.samples[index.index_number] = offset
+                track.indexes[index.index_number] = offset * CUE_FRAMES_PER_SECOND // rate
+            sheet.tracks.append(track)
+        sheet.tracks.sort(key=lambda t: t.number)
+    else:
+        return None
+
+    if sheet is None or not sheet.tracks:
+        return None
+    # A sheet without album TITLE/PERFORMER falls back to the FLAC's own tags
+    sheet.title = sheet.title or (tags.get('ALBUM') or [""])[0]
+    sheet.performer = sheet.performer or (tags.get('ARTIST') or [""])[0]
+    name = os.path.basename(audio_path)
+    sheet.files = [name]
+    for track in sheet.tracks:
+        track.file = name
+        track.performer = track.performer or sheet.performer
+    return sheet
+
+
+def load_sheet(sheet_path: str) -> Optional[CueSheet]:
+    """Load the cuesheet of an image from a .cue file or an embedded FLAC cuesheet.
+
+    Args:
+        sheet_path: Path to a .cue file, or to a .flac file with an embedded sheet
+
+    Returns:
+        Parsed CueSheet, or None if parsing fails
+    """
+    if sheet_path.lower().endswith('.cue'):
+        return parse_cue(sheet_path)
+    return read_embedded_cue(sheet_path)
+
+
+def track_tags(track: CueTrack, sheet: CueSheet) -> Dict[str, str]:
+    """Build the tags written into an exported track.
+
+    Args:
+        track: Track being exported
+        sheet: Sheet the track belongs to
+
+    Returns:
+        Non-empty soundfile string attributes (title, artist, album, ...)
+    """
+    tags = {
+        'title': track.title,
+        'artist': track.performer,
+        'album': sheet.title,
+        'tracknumber': str(track.number),
+        'genre': sheet.genre,
+        'date': sheet.date,
+    }
+    return {key: value for key, value in tags.items() if value}
+
+
+def pcm_dtype(subtype: str) -> str:
+    """Pick the dtype that reads a file's samples without conversion loss.
+
+    Args:
+        subtype: soundfile subtype of the file
+
+    Returns:
+        'float64' for floating-point files, 'int32' for PCM
+    """
+    return 'float64' if subtype in ('FLOAT', 'DOUBLE') else 'int32'
+
+
+def verify_track(output_path: str, expected_frames: int, expected_md5: str) -> bool:
+    """Stream an exported track and compare it with its source range.
+
+    Args:
+        output_path: Path of the exported track
+        expected_frames: Sample count of the source range
+        expected_md5: MD5 of the source range's PCM, as read by export_tracks()
+
+    Returns:
+        True if both the sample count and the PCM MD5 match
+    """
+    digest = hashlib.md5()
+    frames = 0
+    try:
+        with sf.SoundFile(output_path) as output:
+            for block in output.blocks(SPLIT_BLOCK_FRAMES, dtype=pcm_dtype(output.subtype)):
+                digest.update(block)
+                frames += len(block)
+    except Exception as e:
+        print(f"Verification failed, cannot read {output_path}: {str(e)}")
+        return False
+
+    if frames != expected_frames:
+        print(f"Verification failed, {frames} of {expected_frames} samples: {output_path}")
+        return False
+    if digest.hexdigest() != expected_md5:
+        print(f"Verification failed, PCM differs from source: {output_path}")
+        return False
+    return True
+
+
+def export_tracks(source: sf.SoundFile, segments: List[Tuple[str, int, int, Dict[str, str]]],
+                  verify: bool = False) -> List[str]:
+    """Decode an open source file once and write all track segments in one pass.
+
+    The source is read sequentially from the first track start, and each
+    block is routed to every segment it overlaps. Outputs keep the container
+    format and sample subtype of the source, and PCM is copied as integers,
+    so the samples are bit-identical. Tags are set on each output as it is
+    opened, so no separate tagging pass is needed.
+
+    With verify, the MD5 of each segment's source PCM is computed while it
+    is copied, and each finished track is read back and checked in a
+    background thread while the following tracks are still being exported.
+
+    Args:
+        source: Open source audio file
+        segments: List of (output_path, start_sample, end_sample, tags) tuples
+        verify: Check each written track against its source range
+
+    Returns:
+        Output paths that were written completely (and verified, if requested)
+    """
+    if not segments:
         return []
 
-    return tracks
+    dtype = pcm_dtype(source.subtype)
+    pending = sorted(segments, key=lambda seg: seg[1])
+    open_tracks: List[Tuple[str, int, int, sf.SoundFile, Any]] = []
+    written: List[str] = []
+    checks: List[Tuple[str, Future]] = []
+    verifier = ThreadPoolExecutor(max_workers=1) if verify else None
+
+    position = pending[0][1]
+    source.seek(position)
+    while pending or open_tracks:
+        # Open every track that starts at the current position
+        while pending and pending[0][1] <= position:
+            output_path, start, end, tags = pending.pop(0)
+            try:
+                output = sf.SoundFile(output_path, 'w', samplerate=source.samplerate,
+                                      channels=source.channels, format=source.format,
+                                      subtype=source.subtype)
+                # Tags must be set before the first samples are written
+                for key, value in tags.items():
+                    setattr(output, key, value)
+                digest = hashlib.md5() if verify else None
+                open_tracks.append((output_path, start, end, output, digest))
+            except Exception as e:
+                print(f"Failed to export {output_path}: {str(e)}")
+        if not open_tracks and not pending:
+            break
+
+        # Read up to the next track boundary, so no block straddles one
+        boundary = min([track[2] for track in open_tracks] +
+                       [segment[1] for segment in pending[:1]])
+        block = source.read(min(SPLIT_BLOCK_FRAMES, boundary - position), dtype=dtype)
+        if not len(block):
+            break  # Source is shorter than its header claims
+        position += len(block)
+
+        for track in list(open_tracks):
+            output_path, start, end, output, digest = track
+            try:
+                output.write(block)
+            except Exception as e:
+                print(f"Failed to export {output_path}: {str(e)}")
+                output.close()
+                open_tracks.remove(track)
+                continue
+            if digest is not None:
+                digest.update(block)
+            if position >= end:
+                output.close()
+                open_tracks.remove(track)
+                if verifier is not None:
+                    checks.append((output_path, verifier.submit(
+                        verify_track, output_path, end - start, digest.hexdigest())))
+                else:
+                    written.append(output_path)
+
+    for output_path, _, _, output, _ in open_tracks:
+        output.close()
+        print(f"Source ended early, track incomplete: {output_path}")
+
+    if verifier is not None:
+        verifier.shutdown()
+        written += [output_path for output_path, check in checks if check.result()]
+
+    return written
+
+
+def track_output_name(track: CueTrack, cd_prefix: str, ext: str) -> str:
+    """Build the file name of an exported track.
+
+    Args:
+        track: Track being exported
+        cd_prefix: Prefix with source file number (format: "CDxx-")
+        ext: Extension of the source, including the dot
+
+    Returns:
+        File name formatted as "CDxx-XX-title-performer.ext"
+    """
+    # Format track number as 2-digit string (e.g., "01", "10")
+    track_num_padded = f"{track.number:02d}"
+
+    # Clean title (use default if empty)
+    clean_title = clean_filename(
+        track.title) if track.title else f"untitled_{track_num_padded}"
+
+    # Clean performer (include only if exists)
+    clean_performer = clean_filename(track.performer) if track.performer else ""
+    performer_part = f"-{clean_performer}" if clean_performer else ""
 
+    # Construct output filename with CD prefix
+    return f"{cd_prefix}{track_num_padded}-{clean_title}{performer_part}{ext}"
 
-def split_audio_by_cue(audio_path: str, cue_tracks: List[Tuple[str, float, str, str]], cd_prefix: str) -> bool:
+
+def audio_duration(audio_path: str) -> float:
+    """Read the duration of an audio file from its header, without decoding.
+
+    Args:
+        audio_path: Path to a .flac or .wav file
+
+    Returns:
+        Duration in seconds, 0.0 if the header cannot be read
+    """
+    try:
+        info = sf.info(audio_path)
+    except Exception:
+        return 0.0
+    return info.frames / info.samplerate if info.samplerate else 0.0
+
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as H:MM:SS.
+
+    Args:
+        seconds: Duration in seconds
+
+    Returns:
+        Formatted duration
+    """
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}"
+
+
+def format_bytes(size: float) -> str:
+    """Format a byte count with a binary unit.
+
+    Args:
+        size: Number of bytes
+
+    Returns:
+        Formatted size (e.g., "1.5 GB")
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def split_audio_by_cue(audio_path: str, cue_tracks: List[CueTrack], cd_prefix: str,
+                       verify: bool = False, sheet: Optional[CueSheet] = None) -> bool:
     """Split audio file into segments based on CUE track information.
 
     Exports split segments with filenames formatted as:
@@ -246,104 +937,134 @@ def split_audio_by_cue(audio_path: str, cue_tracks: List[Tuple[str, float, str,
     - title = cleaned track title from CUE
     - performer = cleaned performer from CUE (optional)
 
+    Track ranges are computed in samples, and the source is decoded once and
+    streamed block by block into all track files, so memory use does not grow
+    with the length of the image and consecutive tracks join without gaps.
+    TITLE/ARTIST/TRACKNUMBER/ALBUM tags are written during the same pass.
+
     Args:
         audio_path: Path to source audio file (.flac or .wav)
-        cue_tracks: Track info from parse_cue()
+        cue_tracks: Tracks of the sheet from parse_cue()
         cd_prefix: Prefix with source file number (format: "CDxx-")
+        verify: Check every exported track against the source
+        sheet: Sheet the tracks belong to, for album-level tags
 
     Returns:
-        True if at least one track was successfully exported, False otherwise
+        True if at least one track was successfully exported (with verify:
+        if every track was exported and verified), False otherwise
     """
+    ext = os.path.splitext(audio_path)[1].lower()
+    if ext not in ('.flac', '.wav'):
+        print(f"Unsupported format: {audio_path}")
+        return False
+
     try:
-        ext = os.path.splitext(audio_path)[1].lower()
-        # Load audio file based on extension
-        if ext == '.flac':
-            audio = AudioSegment.from_file(audio_path, format='flac')
-        elif ext == '.wav':
-            audio = AudioSegment.from_wav(audio_path)
-        else:
-            print(f"Unsupported format: {audio_path}")
-            return False
+        source = sf.SoundFile(audio_path)
     except Exception as e:
         print(f"Failed to load audio {audio_path}: {str(e)}")
         return False
 
-    total_duration = len(audio) / 1000  # Total duration in seconds
     dir_name = os.path.dirname(audio_path)
     base_ext = ext
-    success = False  # Flag for successful export
+    segments: List[Tuple[str, int, int, Dict[str, str]]] = []
+    sheet = sheet or CueSheet()
 
-    # Process each track
-    for i, (track_num, start_sec, title, performer) in enumerate(cue_tracks):
-        # Format track number as 2-digit string (e.g., "01", "10")
-        try:
-            track_num_padded = f"{int(track_num):02d}"
-        except ValueError:
-            print(f"Invalid track number {track_num}, skipping")
-            continue
+    with source:
+        total_samples = source.frames
 
-        # Clean title (use default if empty)
-        original_base = os.path.splitext(os.path.basename(audio_path))[0]
-        clean_title = clean_filename(
-            title) if title else f"untitled_{track_num_padded}"
+        # Process each track
+        for i, track in enumerate(cue_tracks):
+            track_num_padded = f"{track.number:02d}"
+            output_path = os.path.join(dir_name, track_output_name(track, cd_prefix, base_ext))
 
-        # Clean performer (include only if exists)
-        clean_performer = clean_filename(performer) if performer else ""
-        performer_part = f"-{clean_performer}" if clean_performer else ""
+            # Calculate start/end offsets in samples
+            start = track.start_sample(source.samplerate)
+            if i < len(cue_tracks) - 1:
+                end = cue_tracks[i+1].start_sample(source.samplerate)
+            else:
+                end = total_samples  # Last track ends at file end
+            end = min(end, total_samples)
 
-        # Construct output filename with CD prefix and path
-        output_name = f"{cd_prefix}{track_num_padded}-{clean_title}{performer_part}{base_ext}"
-        output_path = os.path.join(dir_name, output_name)
+            # Validate sample range
+            if start >= end:
+                print(
+                    f"Invalid time range, skipping track {track_num_padded}: {audio_path}")
+                continue
 
-        # Calculate start/end times in milliseconds
-        start_ms = start_sec * 1000
-        if i < len(cue_tracks) - 1:
-            end_sec = cue_tracks[i+1][1]
-            end_ms = end_sec * 1000
-        else:
-            end_ms = total_duration * 1000  # Last track ends at file end
+            segments.append((output_path, start, end, track_tags(track, sheet)))
 
-        # Validate time range
-        if start_ms >= end_ms or start_ms >= total_duration * 1000:
-            print(
-                f"Invalid time range, skipping track {track_num_padded}: {audio_path}")
-            continue
+        # Export all split segments in a single pass over the source
+        written = export_tracks(source, segments, verify)
 
-        # Export split segment
-        try:
-            split_audio = audio[start_ms:end_ms]
-            # Format without leading dot
-            split_audio.export(output_path, format=base_ext[1:])
-            # print(f"Generated: {output_path}")
-            success = True  # Mark as successful if any track exports
-        except Exception as e:
-            print(f"Failed to export {output_path}: {str(e)}")
+    if verify:
+        # Only a fully verified image may have its source backed up
+        return len(written) == len(cue_tracks)
+    # Successful if at least one track was exported
+    return len(written) > 0
 
-    return success
 
+def resolve_cue_files(sheet: CueSheet, cue_path: str,
+                      listing: DirectoryListing) -> Optional[Dict[str, str]]:
+    """Map the FILE references of a CUE sheet to audio files in its directory.
+
+    A reference matches an audio file of the same name, or of the same name
+    with another supported extension (rips are often re-encoded after the
+    sheet was written). A sheet with a single FILE, or none at all, also
+    falls back to the audio file sharing the sheet's own name. Everything is
+    looked up in the directory listing, without filesystem calls.
 
-def backup_source_files(audio_path: str, cue_path: str) -> None:
+    Args:
+        sheet: Parsed CUE sheet
+        cue_path: Path to the CUE file
+        listing: Listing of the CUE file's directory
+
+    Returns:
+        Audio path for each FILE reference ("" if the sheet has none),
+        or None if any reference cannot be resolved
+    """
+    by_name = {os.path.basename(path).lower(): path for path in listing.audio_files}
+    by_stem = {os.path.splitext(name)[0]: path for name, path in by_name.items()}
+    refs = list(dict.fromkeys(track.file for track in sheet.tracks))
+
+    resolved: Dict[str, str] = {}
+    for ref in refs:
+        name = os.path.basename(ref.replace('\\', '/')).lower()
+        audio_path = by_name.get(name) or by_stem.get(os.path.splitext(name)[0])
+        if audio_path is None and len(refs) == 1:
+            stem = os.path.splitext(os.path.basename(cue_path))[0].lower()
+            audio_path = by_stem.get(stem)
+        if audio_path is None:
+            print(f"Referenced audio file not found, skipping: {ref or cue_path}")
+            return None
+        resolved[ref] = audio_path
+    return resolved
+
+
+def backup_source_files(audio_paths: List[str], cue_path: Optional[str]) -> None:
     """Backup original audio and CUE files by renaming to .bak extensions.
 
     Skips backup if .bak file already exists.
 
     Args:
-        audio_path: Path to original audio file
-        cue_path: Path to original CUE file
+        audio_paths: Paths to the original audio files of the sheet
+        cue_path: Path to original CUE file, or None for an embedded cuesheet
     """
-    # Backup audio file
-    audio_bak = f"{audio_path}.bak"
-    if os.path.exists(audio_path):
-        try:
-            if os.path.exists(audio_bak):
-                print(f"Backup exists, skipping: {audio_bak}")
-            else:
-                os.rename(audio_path, audio_bak)
-                # print(f"Backed up audio: {audio_bak}")
-        except Exception as e:
-            print(f"Failed to backup audio {audio_path}: {str(e)}")
+    # Backup audio files
+    for audio_path in audio_paths:
+        audio_bak = f"{audio_path}.bak"
+        if os.path.exists(audio_path):
+            try:
+                if os.path.exists(audio_bak):
+                    print(f"Backup exists, skipping: {audio_bak}")
+                else:
+                    os.rename(audio_path, audio_bak)
+                    # print(f"Backed up audio: {audio_bak}")
+            except Exception as e:
+                print(f"Failed to backup audio {audio_path}: {str(e)}")
 
     # Backup CUE file
+    if cue_path is None:
+        return
     cue_bak = f"{cue_path}.bak"
     if os.path.exists(cue_path):
         try:
@@ -356,72 +1077,279 @@ def backup_source_files(audio_path: str, cue_path: str) -> None:
             print(f"Failed to backup CUE {cue_path}: {str(e)}")
 
 
-def main(root_dir: str) -> None:
+def split_image(sheet_path: str, sources: List[Tuple[str, str, str]], verify: bool = False) -> bool:
+    """Parse the cuesheet of one image and split its audio files into tracks.
+
+    Each referenced audio file is opened only while its own tracks are being
+    exported, so a multi-disc sheet never holds more than one source open.
+    Runs in a worker process when several jobs are used, so it only reports
+    the result; backing up the source files is left to the caller.
+
+    Args:
+        sheet_path: Path to the CUE file, or to a FLAC file with an embedded sheet
+        sources: (FILE reference, audio path, CD prefix) for each referenced
+            audio file, from resolve_cue_files()
+        verify: Check every exported track against the source
+
+    Returns:
+        True if every audio file exported at least one track, False otherwise
+    """
+    # Parse CUE sheet for track information
+    sheet = load_sheet(sheet_path)
+    if sheet is None or not sheet.tracks:
+        print(f"No valid track info in CUE, skipping: {sheet_path}")
+        return False
+
+    success = True
+    for ref, audio_path, cd_prefix in sources:
+        tracks = [track for track in sheet.tracks if track.file == ref]
+        print(f"Starting split: {audio_path} ({len(tracks)} tracks)")
+        if not split_audio_by_cue(audio_path, tracks, cd_prefix, verify, sheet):
+            success = False
+    return success
+
+
+def print_plan(images: List[Tuple[str, List[Tuple[str, str, str]], str]],
+               sheets: Dict[str, CueSheet], durations: Dict[str, float],
+               throughput: Optional[Tuple[float, float, int]], jobs: int) -> None:
+    """Print the actions a run would take, with its cost estimate.
+
+    Args:
+        images: Queued images from main()
+        sheets: Parsed sheet of each image, keyed by sheet path
+        durations: Duration of each source audio file, from its header
+        throughput: (audio_seconds, wall_seconds, jobs) of the last real run
+        jobs: Number of images that would be split in parallel
+    """
+    total_seconds = 0.0
+    bytes_to_write = 0
+    track_count = 0
+    for sheet_path, sources, _ in images:
+        sheet = sheets[sheet_path]
+        print(f"\nSplit: {sheet_path}")
+        for ref, audio_path, cd_prefix in sources:
+            tracks = [track for track in sheet.tracks if track.file == ref]
+            size = os.path.getsize(audio_path)
+            ext = os.path.splitext(audio_path)[1].lower()
+            print(f"  {os.path.basename(audio_path)} ({len(tracks)} tracks, "
+                  f"{format_duration(durations[audio_path])}, {format_bytes(size)})")
+            for track in tracks:
+                print(f"    -> {track_output_name(track, cd_prefix, ext)}")
+            total_seconds += durations[audio_path]
+            # Tracks keep the source codec, so they add up to about its size
+            bytes_to_write += size
+            track_count += len(tracks)
+        backups = [os.path.basename(audio_path) for _, audio_path, _ in sources]
+        if sheet_path.lower().endswith('.cue'):
+            backups.append(os.path.basename(sheet_path))
+        print(f"  Back up: {', '.join(backups)}")
+
+    print(f"\nPlan: {len(images)} images, {track_count} tracks")
+    print(f"Total audio duration: {format_duration(total_seconds)}")
+    print(f"Bytes to write: {format_bytes(bytes_to_write)}")
+    if throughput is None:
+        print("Estimated wall time: unknown, no recorded throughput yet "
+              "(run once without --plan)")
+    else:
+        # Assumes the recorded run scales linearly to the planned job count
+        audio_seconds, wall_seconds, recorded_jobs = throughput
+        estimate = total_seconds / (audio_seconds / wall_seconds) * recorded_jobs / jobs
+        print(f"Estimated wall time: {format_duration(estimate)} ({jobs} job(s), "
+              f"{audio_seconds / wall_seconds:.0f}x realtime recorded with {recorded_jobs})")
+
+
+def main(root_dir: str, jobs: int = 1, rescan: bool = False, verify: bool = False,
+         plan: bool = False) -> None:
     """Main function to process audio files and split using CUE sheets.
 
     Workflow:
-    1. Delete backup files ending with (1)
-    2. Find all audio files recursively
-    3. Group audio files by their parent directory
-    4. For each directory:
-        a. Sort audio files in the directory using natural sorting (numbers as values)
-        b. Process each audio file with directory-specific CD numbering
-        c. Check for matching CUE file and split if valid
-        d. Backup original files if splitting succeeds
+    1. List directories changed since the last run in a single walk
+    2. Delete backup files ending with (1) in those directories
+    3. For each directory:
+        a. Take its audio files, naturally sorted (numbers as values)
+        b. Assign directory-specific CD numbering to each audio file
+        c. Resolve the FILE references of each CUE sheet against the listing
+           and queue the image unless already split
+    4. Split the queued images, several at a time if jobs > 1
+    5. Backup original files of each image whose split succeeded
+    6. Record split images and fully processed directories in the index
 
     Args:
         root_dir: Root directory to process
+        jobs: Number of images to split in parallel
+        rescan: List every directory, ignoring recorded directory mtimes
+        verify: Check every exported track before backing up its source
+        plan: Only list the actions with their total duration, bytes to
+            write and estimated wall time, without writing anything
     """
-    # First delete backup files ending with (1)
-    print("Deleting backup files with names ending with (1)...")
-    delete_backup_files(root_dir)
-
-    audio_files = get_all_audio_files(root_dir)
-    # Group audio files by their parent directory
-    dir_groups = group_audio_files_by_directory(audio_files)
-    print(
-        f"Found {len(audio_files)} audio files across {len(dir_groups)} directories")
-
-    # Process each directory separately
-    for dir_path, dir_audio_files in dir_groups.items():
-        # Sort audio files in current directory using natural sorting (handles numbers correctly)
-        dir_audio_files.sort(
-            key=lambda x: natural_sort_key(os.path.basename(x)))
-        print(
-            f"\nProcessing directory: {dir_path} with {len(dir_audio_files)} audio files")
-
-        # Process each audio file in this directory with CD numbering (per directory)
-        for cd_index, audio_path in enumerate(dir_audio_files, 1):
-            # Create CD prefix with 2-digit numbering (unique within current directory)
-            cd_prefix = f"CD{cd_index:02d}-"
+    index = LibraryIndex(root_dir, read_only=plan)
+    try:
+        listings = list(walk_library(root_dir, index, rescan))
+        print(f"Scanning {len(listings)} new or changed directories")
+
+        # First delete backup files ending with (1)
+        if plan:
+            for listing in listings:
+                for file_path in listing.duplicates:
+                    print(f"Would delete backup file: {file_path}")
+        else:
+            print("Deleting backup files with names ending with (1)...")
+            for listing in listings:
+                delete_backup_files(listing.duplicates)
 
-            # Check for matching CUE file (same name, .cue extension)
-            cue_path = os.path.splitext(audio_path)[0] + '.cue'
-            if not os.path.exists(cue_path):
+        dir_groups = [listing for listing in listings if listing.audio_files]
+        print(
+            f"Found {sum(len(listing.audio_files) for listing in dir_groups)} "
+            f"audio files across {len(dir_groups)} directories")
+
+        # Collect images first, so CD numbers are fixed before any work runs:
+        # (sheet path, [(FILE reference, audio path, CD prefix)], fingerprint)
+        images: List[Tuple[str, List[Tuple[str, str, str]], str]] = []
+        sheets: Dict[str, CueSheet] = {}
+        failed_dirs = set()
+        for listing in dir_groups:
+            print(
+                f"\nProcessing directory: {listing.path} with {len(listing.audio_files)} audio files")
+
+            # Number each audio file in this directory (per directory), using
+            # 2-digit CD prefixes unique within the current directory
+            cd_prefixes = {audio_path: f"CD{cd_index:02d}-"
+                           for cd_index, audio_path in enumerate(listing.audio_files, 1)}
+
+            # Follow each CUE sheet's FILE references to its audio files
+            claimed = set()
+            for cue_path in sorted(listing.cue_files.values(),
+                                   key=lambda x: natural_sort_key(os.path.basename(x))):
+                sheet = parse_cue(cue_path)
+                if sheet is None or not sheet.tracks:
+                    print(f"No valid track info in CUE, skipping: {cue_path}")
+                    failed_dirs.add(listing.path)
+                    continue
+                resolved = resolve_cue_files(sheet, cue_path, listing)
+                if resolved is None:
+                    failed_dirs.add(listing.path)
+                    continue
+                if claimed.intersection(resolved.values()):
+                    print(f"Audio already claimed by another CUE, skipping: {cue_path}")
+                    continue
+                claimed.update(resolved.values())
+
+                # Skip images the index already records as split
+                fingerprint = image_fingerprint(
+                    [(path, listing.entries[path].stat().st_size) for path in resolved.values()],
+                    cue_path)
+                if index.is_split(fingerprint):
+                    print(f"Already split, skipping: {cue_path}")
+                    continue
+
+                sources = [(ref, audio_path, cd_prefixes[audio_path])
+                           for ref, audio_path in resolved.items()]
+                images.append((cue_path, sources, fingerprint))
+                sheets[cue_path] = sheet
+
+            for audio_path in listing.audio_files:
+                if audio_path in claimed:
+                    continue
+                # FLAC images may carry their cuesheet in the header instead
+                embedded = read_embedded_cue(audio_path) \
+                    if audio_path.lower().endswith('.flac') else None
+                if embedded is not None:
+                    fingerprint = image_fingerprint(
+                        [(audio_path, listing.entries[audio_path].stat().st_size)], None)
+                    if index.is_split(fingerprint):
+                        print(f"Already split, skipping: {audio_path}")
+                        continue
+                    name = os.path.basename(audio_path)
+                    images.append((audio_path, [(name, audio_path, cd_prefixes[audio_path])],
+                                   fingerprint))
+                    sheets[audio_path] = embedded
+                    continue
                 print(f"No matching CUE file, skipping: {audio_path}")
-                continue
 
-            # Parse CUE sheet for track information
-            cue_tracks = parse_cue(cue_path)
-            if not cue_tracks:
-                print(f"No valid track info in CUE, skipping: {cue_path}")
-                continue
+        # Source durations from the headers, for the plan and the throughput record
+        durations = {audio_path: audio_duration(audio_path)
+                     for _, sources, _ in images for _, audio_path, _ in sources}
+        phase = "split+verify" if verify else "split"
 
-            # Split audio with directory-specific CD prefix and check success
-            print(f"Starting split: {audio_path} ({len(cue_tracks)} tracks)")
-            split_success = split_audio_by_cue(
-                audio_path, cue_tracks, cd_prefix)
+        if plan:
+            print_plan(images, sheets, durations, index.throughput(phase), jobs)
+            return
 
+        def finish(sheet_path: str, sources: List[Tuple[str, str, str]],
+                   fingerprint: str, split_success: bool) -> None:
             # Backup source files only if split succeeded
+            audio_paths = [audio_path for _, audio_path, _ in sources]
             if split_success:
-                backup_source_files(audio_path, cue_path)
+                index.mark_split(fingerprint, sheet_path)
+                cue_path = sheet_path if sheet_path.lower().endswith('.cue') else None
+                backup_source_files(audio_paths, cue_path)
             else:
-                print(f"Split failed, not backing up: {audio_path}")
+                print(f"Split failed, not backing up: {', '.join(audio_paths)}")
+                failed_dirs.add(os.path.dirname(sheet_path))
+
+        split_start = time.perf_counter()
+        if jobs <= 1:
+            for sheet_path, sources, fingerprint in images:
+                finish(sheet_path, sources, fingerprint,
+                       split_image(sheet_path, sources, verify))
+        else:
+            print(f"\nSplitting {len(images)} images with {jobs} jobs")
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = {pool.submit(split_image, *image[:2], verify): image
+                           for image in images}
+                for future in as_completed(futures):
+                    sheet_path, sources, fingerprint = futures[future]
+                    try:
+                        split_success = future.result()
+                    except Exception as e:
+                        print(f"Failed to split {sheet_path}: {str(e)}")
+                        split_success = False
+                    finish(sheet_path, sources, fingerprint, split_success)
+        index.record_throughput(phase, sum(durations.values()),
+                                time.perf_counter() - split_start, jobs)
+
+        # Record directories as they are now, after splitting and backups, so
+        # the next run only lists them again if something else changes them.
+        # Directories with failed images stay unrecorded to be retried.
+        for listing in listings:
+            dir_path = listing.path
+            if dir_path in failed_dirs:
+                index.forget_directory(dir_path)
+                continue
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+            index.update_directory(dir_path, mtime_ns, listing.subdirs)
+    finally:
+        index.close()
 
 
 if __name__ == "__main__":
-    target_directory = input("Enter root directory to process: ").strip()
+    parser = argparse.ArgumentParser(
+        description="Split CUE images into tracks and back up the sources.")
+    parser.add_argument("directory", nargs="?",
+                        help="Root directory to process (prompted if omitted)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of images to split in parallel "
+                             "(default: 1, 0 = one per CPU)")
+    parser.add_argument("--rescan", action="store_true",
+                        help="List every directory, even ones the library "
+                             "index records as unchanged")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check each exported track's sample count and "
+                             "PCM MD5 against the source before backing it up")
+    parser.add_argument("--plan", action="store_true",
+                        help="Dry run: list the actions with total duration, "
+                             "bytes to write and estimated wall time, "
+                             "without writing anything")
+    args = parser.parse_args()
+
+    target_directory = args.directory
+    if target_directory is None:
+        target_directory = input("Enter root directory to process: ").strip()
     if os.path.isdir(target_directory):
-        main(target_directory)
+        main(target_directory, args.jobs if args.jobs > 0 else (os.cpu_count() or 1),
+             args.rescan, args.verify, args.plan)
     else:
         print("Invalid directory path!")
@@ -1,27 +1,363 @@
+import argparse
+import glob
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
 from PIL import Image
 
+# Linear sRGB to CIE XYZ, and the D65 reference white
+SRGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]], dtype=np.float32)
+D65_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+# Files picked up when a whole directory is recoloured
+IMAGE_EXTENSIONS = (".png",)
+# 8-bit PNG modes that can be decoded strip by strip
+TILED_MODES = ("L", "LA", "RGB", "RGBA")
+# Pillow's PNG writer, mirrored so tiled output matches it byte for byte: per-row
+# filters tried in this order (None, Up, Sub, Paeth), Z_FILTERED deflate with
+# memLevel 9, and IDAT chunks of at least this many bytes
+PNG_FILTERS = (0, 2, 1, 4)
+PNG_CHUNK_BYTES = 65536
+
 def hex_to_rgb(hex_color: str):
     """Convert a hex color string (#RRGGBB) to an RGB tuple."""
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
+def load_mapping(path: str) -> dict:
+    """Read a colour mapping from a JSON object or a text file of "SRC DST" lines."""
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            return json.load(f)
+        mapping = {}
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 2:
+                raise ValueError(f"Expected 'SRC DST' in {path}: {line.strip()}")
+            mapping[parts[0]] = parts[1]
+        return mapping
+
+def pack_rgb(pixels: np.ndarray) -> np.ndarray:
+    """Pack the RGB channels of an (..., 3+) uint8 array into 24-bit integer keys."""
+    rgb = pixels[..., :3].astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert an (..., 3) array of sRGB values to CIE Lab (D65)."""
+    c = rgb.astype(np.float32) / 255
+    c = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = (c @ SRGB_TO_XYZ.T) / D65_WHITE
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16,
+                     500 * (f[..., 0] - f[..., 1]),
+                     200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+def remap_palette(img: Image.Image, colors: dict, tolerance: float = 0.0,
+                  metric: str = "rgb", soft: bool = False) -> None:
+    """Rewrite the matching entries of a palette image's palette in place."""
+    palette = np.array(img.getpalette(), dtype=np.uint8).reshape(-1, 3)
+    remap(palette, colors, tolerance, metric, soft)
+    img.putpalette(palette.ravel().tolist())
+
+def remap_pixels(pixels: np.ndarray, colors: dict) -> None:
+    """Recolour an RGBA array in place with one sorted lookup of packed RGB keys."""
+    src_keys = pack_rgb(np.array(list(colors), dtype=np.uint8))
+    dst_colors = np.array(list(colors.values()), dtype=np.uint8)
+    order = np.argsort(src_keys)
+    src_keys, dst_colors = src_keys[order], dst_colors[order]
+
+    # Binary search per pixel, so the cost barely grows with the mapping size
+    keys = pack_rgb(pixels)
+    idx = np.minimum(np.searchsorted(src_keys, keys), len(src_keys) - 1)
+    mask = src_keys[idx] == keys
+    pixels[mask, :3] = dst_colors[idx[mask]]
+
+def remap_within(pixels: np.ndarray, colors: dict, tolerance: float,
+                 metric: str = "rgb", soft: bool = False) -> None:
+    """Recolour pixels within an RGB or Lab (delta E) distance of a source color, in place."""
+    rgb = pixels[..., :3]
+    space = rgb_to_lab(rgb) if metric == "lab" else rgb.astype(np.float32)
+    src_colors = np.array(list(colors), dtype=np.uint8)
+    dst_colors = np.array(list(colors.values()), dtype=np.uint8)
+    refs = rgb_to_lab(src_colors) if metric == "lab" else src_colors.astype(np.float32)
+
+    # One vectorized pass over the image per source color
+    best = np.full(rgb.shape[:-1], np.inf, dtype=np.float32)
+    nearest = np.zeros(rgb.shape[:-1], dtype=np.intp)
+    for i, ref in enumerate(refs):
+        dist = np.sqrt(((space - ref) ** 2).sum(axis=-1))
+        closer = (dist <= tolerance) & (dist < best)
+        best[closer] = dist[closer]
+        nearest[closer] = i
+
+    # Soft blending shifts each pixel by the source-to-target difference
+    # scaled by 1 - distance / tolerance, so anti-aliased edges keep their mix
+    matched = np.isfinite(best)
+    targets = nearest[matched]
+    if soft and tolerance > 0:
+        weight = (1 - best[matched] / tolerance)[:, None]
+        delta = dst_colors[targets].astype(np.float32) - src_colors[targets]
+        rgb[matched] = np.clip(np.rint(rgb[matched] + weight * delta), 0, 255)
+    else:
+        rgb[matched] = dst_colors[targets]
+
+def remap(pixels: np.ndarray, colors: dict, tolerance: float = 0.0,
+          metric: str = "rgb", soft: bool = False) -> None:
+    """Recolour an (..., 3+) array in place, exactly or within a tolerance."""
+    if tolerance > 0:
+        remap_within(pixels, colors, tolerance, metric, soft)
+    else:
+        remap_pixels(pixels, colors)
+
+def replace_colors(input_path: str, output_path: str, mapping: dict,
+                   tolerance: float = 0.0, metric: str = "rgb", soft: bool = False,
+                   quiet: bool = False) -> int:
+    """Replace several colors in a PNG image in a single pass and return its pixel count."""
+    colors = {hex_to_rgb(src): hex_to_rgb(dst) for src, dst in mapping.items()}
+
+    img = Image.open(input_path)
+    if img.mode == "P":
+        # Only the palette changes; pixel indices stay as they are
+        remap_palette(img, colors, tolerance, metric, soft)
+    else:
+        img = img.convert("RGBA")
+        pixels = np.asarray(img).copy()
+        remap(pixels, colors, tolerance, metric, soft)
+        img.frombytes(pixels.tobytes())
+
+    img.save(output_path)
+    if not quiet:
+        print(f"{len(colors)} color(s) replaced and saved to: {output_path}")
+    return img.width * img.height
+
 def replace_color(input_path: str, output_path: str, src_hex: str, dst_hex: str):
     """Replace a specific color in a PNG image with another color."""
-    src_color = hex_to_rgb(src_hex)
-    dst_color = hex_to_rgb(dst_hex)
+    replace_colors(input_path, output_path, {src_hex: dst_hex})
 
-    img = Image.open(input_path).convert("RGBA")
-    pixels = img.load()
+def iter_idat(fp):
+    """Yield the payloads of a PNG file's IDAT chunks in order."""
+    fp.seek(8)
+    while True:
+        length, chunk_type = struct.unpack(">I4s", fp.read(8))
+        if chunk_type == b"IEND":
+            return
+        if chunk_type == b"IDAT":
+            yield fp.read(length)
+            fp.seek(4, os.SEEK_CUR)
+        else:
+            fp.seek(length + 4, os.SEEK_CUR)
 
-    width, height = img.size
-    for y in range(height):
-        for x in range(width):
-            r, g, b, a = pixels[x, y]
-            if (r, g, b) == src_color:
-                pixels[x, y] = (*dst_color, a)
+def read_strips(img: Image.Image, path: str, rows: int):
+    """Decode a non-interlaced 8-bit PNG in strips of rows without loading it whole."""
+    stride = 1 + img.width * len(img.mode)
+    inflater = zlib.decompressobj()
+    # Rows filtered against the row above (Up, Average, Paeth) need it unfiltered,
+    # so each strip is decoded behind a copy of that row stored with filter type 0
+    above = bytes(stride)
+    with open(path, "rb") as fp:
+        chunks = iter_idat(fp)
+        for top in range(0, img.height, rows):
+            count = min(rows, img.height - top)
+            data = bytearray(above)
+            while len(data) < stride * (count + 1):
+                chunk = inflater.unconsumed_tail or next(chunks, None)
+                if chunk is None:
+                    raise ValueError(f"Truncated image data in {path}")
+                data += inflater.decompress(chunk, stride * (count + 1) - len(data))
+            strip = Image.frombytes(img.mode, (img.width, count + 1),
+                                    zlib.compress(data, 0), "zip", img.mode)
+            above = b"\0" + strip.crop((0, count, img.width, count + 1)).tobytes()
+            yield strip.crop((0, 1, img.width, count + 1))
 
-    img.save(output_path)
-    print(f"Color replaced and saved to: {output_path}")
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """Frame data as a PNG chunk with its length and CRC."""
+    return (struct.pack(">I", len(data)) + chunk_type + data
+            + struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+def filter_rows(rows: np.ndarray, above: np.ndarray, bpp: int) -> np.ndarray:
+    """PNG-filter (n, stride) rows, picking each row's filter by least sum of |signed bytes|."""
+    raw = rows.astype(np.int16)
+    prior = np.empty_like(raw)
+    prior[0] = above
+    prior[1:] = raw[:-1]
+    left = np.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    upper_left = np.zeros_like(raw)
+    upper_left[:, bpp:] = prior[:, :-bpp]
+
+    # Candidates in PNG_FILTERS order; uint8 wraps the differences modulo 256
+    candidates = np.empty((len(PNG_FILTERS),) + rows.shape, dtype=np.uint8)
+    candidates[0] = rows
+    candidates[1] = (raw - prior).astype(np.uint8)
+    candidates[2] = (raw - left).astype(np.uint8)
+    estimate = left + prior - upper_left
+    to_left = np.abs(estimate - left)
+    to_prior = np.abs(estimate - prior)
+    to_corner = np.abs(estimate - upper_left)
+    paeth = np.where(to_prior <= to_corner, prior, upper_left)
+    paeth = np.where((to_left <= to_prior) & (to_left <= to_corner), left, paeth)
+    candidates[3] = (raw - paeth).astype(np.uint8)
+
+    cost = np.array([np.abs(c.view(np.int8), dtype=np.int16).sum(axis=-1, dtype=np.int64)
+                     for c in candidates])
+    choice = np.argmin(cost, axis=0)
+    filtered = candidates[choice, np.arange(len(rows))]
+    return np.hstack([np.array(PNG_FILTERS, dtype=np.uint8)[choice][:, None], filtered])
+
+def write_png_strips(output_path: str, width: int, height: int, strips,
+                     icc_profile: bytes | None = None) -> None:
+    """Write (rows, width, 4) RGBA strips as a PNG, compressing IDAT as they arrive."""
+    chunk_bytes = max(PNG_CHUNK_BYTES, width * 4)
+    deflater = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 15, 9,
+                                zlib.Z_FILTERED)
+    above = np.zeros(width * 4, dtype=np.uint8)
+    pending = bytearray()
+    with open(output_path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        if icc_profile:
+            f.write(png_chunk(b"iCCP", b"ICC Profile\0\0" + zlib.compress(icc_profile)))
+        for pixels in strips:
+            rows = pixels.reshape(len(pixels), -1)
+            pending += deflater.compress(filter_rows(rows, above, 4).tobytes())
+            above = rows[-1]
+            while len(pending) >= chunk_bytes:
+                f.write(png_chunk(b"IDAT", bytes(pending[:chunk_bytes])))
+                del pending[:chunk_bytes]
+        pending += deflater.flush()
+        for start in range(0, len(pending), chunk_bytes):
+            f.write(png_chunk(b"IDAT", bytes(pending[start:start + chunk_bytes])))
+        f.write(png_chunk(b"IEND", b""))
+
+def replace_colors_tiled(input_path: str, output_path: str, mapping: dict,
+                         tolerance: float = 0.0, metric: str = "rgb", soft: bool = False,
+                         rows: int = 256, quiet: bool = False) -> int:
+    """Replace colors strip by strip, with output identical to replace_colors."""
+    img = Image.open(input_path)
+    if (img.format != "PNG" or img.mode not in TILED_MODES or img.info.get("interlace")
+            or img.tile[0].args != img.mode):
+        # Palette images only get a new palette, and interlaced, 16-bit and
+        # sub-byte images cannot be decoded in strips: both keep the whole-image path
+        return replace_colors(input_path, output_path, mapping, tolerance, metric, soft, quiet)
+    colors = {hex_to_rgb(src): hex_to_rgb(dst) for src, dst in mapping.items()}
+
+    def recolored_strips():
+        for strip in read_strips(img, input_path, rows):
+            if "transparency" in img.info:
+                strip.info["transparency"] = img.info["transparency"]
+            pixels = np.asarray(strip.convert("RGBA")).copy()
+            remap(pixels, colors, tolerance, metric, soft)
+            yield pixels
+
+    # Only one strip is decoded, recoloured and compressed at a time
+    write_png_strips(output_path, img.width, img.height, recolored_strips(),
+                     img.info.get("icc_profile"))
+    if not quiet:
+        print(f"{len(colors)} color(s) replaced and saved to: {output_path}")
+    return img.width * img.height
+
+def find_images(source: str):
+    """Return the base directory and image paths of a directory tree or glob pattern."""
+    if os.path.isdir(source):
+        paths = [os.path.join(dirpath, name)
+                 for dirpath, _, names in os.walk(source) for name in names
+                 if name.lower().endswith(IMAGE_EXTENSIONS)]
+        return source, sorted(paths)
+    # The output mirrors everything below the pattern's fixed leading directories
+    parts = source.replace("\\", "/").split("/")
+    fixed = next(i for i, part in enumerate(parts + ["*"]) if glob.has_magic(part))
+    base = "/".join(parts[:fixed]) or "."
+    paths = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
+    return base, sorted(paths)
+
+def recolor_file(input_path: str, output_path: str, mapping: dict,
+                 tolerance: float, metric: str, soft: bool, tile_rows: int = 0) -> int:
+    """Recolour one file of a batch, creating its output directory."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if tile_rows:
+        return replace_colors_tiled(input_path, output_path, mapping, tolerance, metric,
+                                    soft, tile_rows, quiet=True)
+    return replace_colors(input_path, output_path, mapping, tolerance, metric, soft, quiet=True)
+
+def replace_colors_batch(source: str, output_root: str, mapping: dict, tolerance: float = 0.0,
+                         metric: str = "rgb", soft: bool = False, jobs: int = 0,
+                         tile_rows: int = 0):
+    """Recolour a directory tree or glob into a mirrored output tree with a process pool."""
+    base, paths = find_images(source)
+    tasks = []
+    skipped = 0
+    for input_path in paths:
+        output_path = os.path.join(output_root, os.path.relpath(input_path, base))
+        # Outputs newer than their input are already up to date
+        if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path))
+
+    start = time.perf_counter()
+    done = failed = pixels = 0
+    with ProcessPoolExecutor(max_workers=jobs or None) as pool:
+        futures = {pool.submit(recolor_file, input_path, output_path, mapping,
+                               tolerance, metric, soft, tile_rows): input_path
+                   for input_path, output_path in tasks}
+        for future in as_completed(futures):
+            try:
+                pixels += future.result()
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"Failed: {futures[future]}: {e}")
+    elapsed = time.perf_counter() - start
+
+    print(f"Recolored {done} image(s), skipped {skipped} up to date, {failed} failed")
+    if done:
+        print(f"{elapsed:.2f} s: {done / elapsed:.1f} images/s, "
+              f"{pixels / 1e6 / elapsed:.1f} megapixels/s")
 
 if __name__ == "__main__":
-    replace_color("input.png", "output.png", "#FFFFFF", "#000000")
+    parser = argparse.ArgumentParser(description="Replace colors in a PNG image, "
+                                                 "or in every PNG of a directory tree or glob.")
+    parser.add_argument("input", nargs="?", default="input.png",
+                        help="Image, directory or glob pattern (quote it), e.g. 'icons/**/*.png'")
+    parser.add_argument("output", nargs="?", default="output.png",
+                        help="Output image, or output directory mirroring the input tree")
+    parser.add_argument("-m", "--map", action="append", default=[], metavar="SRC=DST",
+                        help="Color pair to replace, e.g. '#FFFFFF=#000000' (repeatable)")
+    parser.add_argument("-f", "--mapping-file",
+                        help="JSON object or text file of 'SRC DST' lines")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.0,
+                        help="Also replace colors within this distance of a source "
+                             "color (RGB units, or delta E with --metric lab)")
+    parser.add_argument("--metric", choices=["rgb", "lab"], default="rgb",
+                        help="Color distance: Euclidean RGB or delta E in Lab (default: rgb)")
+    parser.add_argument("--soft", action="store_true",
+                        help="Blend matched pixels in proportion to their distance")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="Worker processes for directories and globs (default: one per CPU)")
+    parser.add_argument("--tile-rows", type=int, default=0, metavar="N",
+                        help="Decode, recolor and write truecolor PNGs in strips of N rows, "
+                             "so memory stays bounded on very large images")
+    args = parser.parse_args()
+
+    mapping = load_mapping(args.mapping_file) if args.mapping_file else {}
+    for pair in args.map:
+        src, _, dst = pair.partition("=")
+        mapping[src] = dst
+    if not mapping:
+        mapping = {"#FFFFFF": "#000000"}
+    if os.path.isdir(args.input) or glob.has_magic(args.input):
+        replace_colors_batch(args.input, args.output, mapping, args.tolerance,
+                             args.metric, args.soft, args.jobs, args.tile_rows)
+    elif args.tile_rows:
+        replace_colors_tiled(args.input, args.output, mapping, args.tolerance,
+                             args.metric, args.soft, args.tile_rows)
+    else:
+        replace_colors(args.input, args.output, mapping, args.tolerance, args.metric, args.soft)